@@ -2,12 +2,50 @@ import streamlit as st
 import os
 import sys
 import time
+import threading
+from functools import lru_cache
+from streamlit.runtime.scriptrunner import add_script_run_ctx
 
 # Add parent directory to path for importing utils
 parent_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 sys.path.append(parent_dir)
 
-from utils.authentication import AuthManager, init_auth_session, check_session
+from utils.auth_session import init_auth_session, check_session, get_auth_manager, queue_session_cookie, sync_session_cookie, SESSION_COOKIE_NAME, validate_password_strength
+from utils.session_state import release_vector_store
+
+
+def _get_auth_manager():
+    """Load the full authentication stack only when it is actually needed"""
+    auth_manager = get_auth_manager()
+    st.session_state['auth_manager'] = auth_manager
+    return auth_manager
+
+def _centered():
+    """Return the middle column of a [1, 2, 1] layout for centering a widget"""
+    return st.columns([1, 2, 1])[1]
+
+@st.cache_resource
+def _prewarm_rag():
+    """Import the RAG stack once per process so the upload page starts warm"""
+    import utils.rag
+    return True
+
+def _start_prewarm():
+    """Load the upload page's heavy imports in the background while the redirect happens"""
+    thread = threading.Thread(target=_prewarm_rag, daemon=True)
+    add_script_run_ctx(thread)
+    thread.start()
+
+@lru_cache(maxsize=2)
+def _password_requirements_md(subject: str) -> str:
+    """Build the static password requirements text once per subject"""
+    return (
+        f"{subject} must contain:\n"
+        "- At least 8 characters\n"
+        "- At least one uppercase letter (A-Z)\n"
+        "- At least one lowercase letter (a-z)\n"
+        "- At least one number (0-9)"
+    )
 
 # Page configuration
 st.set_page_config(
@@ -17,25 +55,25 @@ st.set_page_config(
     initial_sidebar_state="collapsed"
 )
 
-# Hide default Streamlit page navigation
-hide_pages_style = """
-    <style>
-    [data-testid="stSidebar"] [data-testid="stSidebarNav"] {
-        display: none;
-    }
-    </style>
-"""
-st.markdown(hide_pages_style, unsafe_allow_html=True)
-
 # Initialize authentication
 init_auth_session()
+sync_session_cookie()
+
+# Restore the session from the signed cookie so a browser refresh doesn't force a new login
+if not st.session_state.get('session_token'):
+    cookie_token = st.context.cookies.get(SESSION_COOKIE_NAME)
+    if cookie_token:
+        is_valid, cookie_user_info = _get_auth_manager().validate_session_token(cookie_token)
+        if is_valid:
+            st.session_state['authenticated'] = True
+            st.session_state['user_info'] = cookie_user_info
+            st.session_state['session_token'] = cookie_user_info['session_token']
 
 # Check for existing valid session
 if check_session():
     st.success(f"✅ Welcome back, {st.session_state['user_info']['email']}!")
     
-    col1, col2, col3 = st.columns([1, 2, 1])
-    with col2:
+    with _centered():
         if st.button("🚀 Launch RAG System", type="primary", use_container_width=True):
             # Use query params to maintain session
             st.query_params["authenticated"] = "true"
@@ -43,13 +81,17 @@ if check_session():
         
         if st.button("🚪 Logout", type="secondary", use_container_width=True):
             # Logout user
-            auth_manager = st.session_state['auth_manager']
+            auth_manager = _get_auth_manager()
             if 'session_token' in st.session_state:
                 auth_manager.logout_user(st.session_state['session_token'])
             
-            # Clear session state completely
-            for key in list(st.session_state.keys()):
-                del st.session_state[key]
+            release_vector_store()
+            
+            # Clear session state in one call, keeping the shared auth manager
+            preserved = {'auth_manager': st.session_state.get('auth_manager')}
+            st.session_state.clear()
+            st.session_state.update({k: v for k, v in preserved.items() if v is not None})
+            queue_session_cookie(None)
             
             # Clear query params
             st.query_params.clear()
@@ -61,19 +103,29 @@ if check_session():
 st.title("🔐 Multimodal RAG System")
 st.markdown("### Secure Authentication Portal")
 
-# Get auth manager
-auth_manager = st.session_state['auth_manager']
+# Get auth manager (the login/register/reset forms need the full auth stack)
+auth_manager = _get_auth_manager()
 
 # Display system stats
 col1, col2 = st.columns(2)
 with col1:
     st.markdown("🔒 Security")
 
-# Authentication tabs
-t1, t2, t3 = st.tabs(["🔑 Login", "📝 Register", "🔄 Forgot Password"])
+# Authentication tabs - only the active one is built on each rerun
+AUTH_TABS = {'login': "🔑 Login", 'register': "📝 Register", 'forgot_password': "🔄 Forgot Password"}
+st.session_state.setdefault('active_tab', 'login')
+active_tab = st.radio(
+    "Authentication",
+    options=list(AUTH_TABS),
+    format_func=AUTH_TABS.get,
+    key='active_tab',
+    horizontal=True,
+    label_visibility="collapsed"
+)
 
 # Login Tab
-with t1:
+@st.fragment
+def _login_tab():
     st.markdown("#### Welcome Back!")
     
     # Create a form for login
@@ -92,8 +144,7 @@ with t1:
         )
         
         # Center the login button
-        col1, col2, col3 = st.columns([1, 2, 1])
-        with col2:
+        with _centered():
             login_submitted = st.form_submit_button(
                 "🔑 Login", 
                 type="primary", 
@@ -117,11 +168,11 @@ with t1:
                     st.session_state['session_token'] = user_data['session_token']
                     st.session_state['login_time'] = time.time()  # Add timestamp
                     
-                    # Show success message with countdown
-                    with st.spinner("🚀 Redirecting to RAG System..."):
-                        time.sleep(2)  # Brief pause to show success
+                    # Overlap the RAG imports with the redirect instead of paying for them on the next page
+                    _start_prewarm()
                     
-                    # Set query param for authentication state
+                    # The upload page posts the signed token to the server, which answers with the HttpOnly cookie
+                    queue_session_cookie(user_data['session_token'])
                     st.query_params["authenticated"] = "true"
                     st.switch_page("pages/app.py")
                 else:
@@ -129,12 +180,12 @@ with t1:
     
     # Quick link to forgot password
     st.markdown("---")
-    col1, col2, col3 = st.columns([1, 2, 1])
-    with col2:
-        st.markdown("🔄 **Forgot your password?** Use the 'Forgot Password' tab above")
+    with _centered():
+        st.markdown("🔄 **Forgot your password?** Use the 'Forgot Password' option above")
 
 # Register Tab with OTP verification
-with t2:
+@st.fragment
+def _register_tab():
     st.markdown("#### Create New Account")
     
     # Multi-step registration process
@@ -166,14 +217,9 @@ with t2:
             
             # Password requirements info
             with st.expander("🔒 Password Requirements"):
-                st.write("Your password must contain:")
-                st.write("• At least 8 characters")
-                st.write("• At least one uppercase letter (A-Z)")
-                st.write("• At least one lowercase letter (a-z)")
-                st.write("• At least one number (0-9)")
+                st.markdown(_password_requirements_md("Your password"))
             
-            col1, col2, col3 = st.columns([1, 2, 1])
-            with col2:
+            with _centered():
                 send_otp_submitted = st.form_submit_button(
                     "📧 Send OTP", 
                     type="primary", 
@@ -186,21 +232,24 @@ with t2:
                 st.error("❌ Please fill in all fields")
             elif register_password != confirm_password:
                 st.error("❌ Passwords do not match")
+            elif not (password_check := validate_password_strength(register_password))[0]:
+                st.error(f"❌ {password_check[1]}")
+            elif not auth_manager.allow_otp_request(register_user_name):
+                st.error("❌ Please wait before requesting another code")
             else:
-                with st.spinner("📧 Sending OTP to your email..."):
-                    success, message = auth_manager.generate_and_send_otp(register_user_name)
+                success, message = auth_manager.generate_and_send_otp(register_user_name)
                     
-                    if success:
-                        st.success(f"✅ {message}")
-                        st.info("📱 Please check your email and enter the OTP below.")
-                        
-                        # Store email and password for next step
-                        st.session_state['pending_email'] = register_user_name
-                        st.session_state['pending_password'] = register_password
-                        st.session_state['registration_step'] = 'otp'
-                        st.rerun()
-                    else:
-                        st.error(f"❌ {message}")
+                if success:
+                    st.success(f"✅ {message}")
+                    st.info("📱 Please check your email and enter the OTP below.")
+                    
+                    # Store email and password hash for next step (never the plaintext password)
+                    st.session_state['pending_email'] = register_user_name
+                    st.session_state['pending_password_hash'] = auth_manager.hash_password(register_password)
+                    st.session_state['registration_step'] = 'otp'
+                    st.rerun()
+                else:
+                    st.error(f"❌ {message}")
     
     # Step 2: OTP Verification
     elif registration_step == 'otp':
@@ -235,22 +284,45 @@ with t2:
         if verify_otp_submitted:
             if not otp_input:
                 st.error("❌ Please enter the OTP")
-            elif len(otp_input) != 6:
-                st.error("❌ OTP must be 6 digits")
             else:
                 with st.spinner("🔍 Verifying OTP..."):
                     success, message = auth_manager.verify_otp(st.session_state['pending_email'], otp_input)
                     
                     if success:
                         st.success(f"✅ {message}")
-                        st.session_state['registration_step'] = 'complete'
-                        st.rerun()
+                        
+                        # Create the account right away instead of rerunning into a separate step
+                        success, message = auth_manager.register_user(
+                            st.session_state['pending_email'], 
+                            st.session_state['pending_password_hash'],
+                            already_hashed=True
+                        )
+                        
+                        # Reset registration state
+                        st.session_state['registration_step'] = 'email'
+                        st.session_state['pending_email'] = None
+                        st.session_state['pending_password_hash'] = None
+                        
+                        if success:
+                            st.success(f"✅ {message}")
+                            st.info("🔑 You can now login with your credentials!")
+                            st.balloons()
+                            
+                            # Auto-switch to login tab would be nice, but we'll show a button
+                            if st.button("🔑 Go to Login", type="primary"):
+                                st.rerun()
+                        else:
+                            st.error(f"❌ {message}")
+                            if st.button("🔄 Try Again"):
+                                st.rerun()
                     else:
                         st.error(f"❌ {message}")
         
         # Handle OTP resend
         if resend_otp_submitted:
-            with st.spinner("📧 Resending OTP..."):
+            if not auth_manager.allow_otp_request(st.session_state['pending_email']):
+                st.error("❌ Please wait before requesting another code")
+            else:
                 success, message = auth_manager.generate_and_send_otp(st.session_state['pending_email'])
                 
                 if success:
@@ -262,42 +334,12 @@ with t2:
         if st.button("⬅️ Back to Email Entry"):
             st.session_state['registration_step'] = 'email'
             st.session_state['pending_email'] = None
-            st.session_state['pending_password'] = None
+            st.session_state['pending_password_hash'] = None
             st.rerun()
-    
-    # Step 3: Complete Registration
-    elif registration_step == 'complete':
-        st.success("🎉 **Step 3:** Email verified! Completing registration...")
-        
-        with st.spinner("👤 Creating your account..."):
-            time.sleep(1)  # Small delay for better UX
-            success, message = auth_manager.register_user(
-                st.session_state['pending_email'], 
-                st.session_state['pending_password']
-            )
-            
-            if success:
-                st.success(f"✅ {message}")
-                st.info("🔑 You can now login with your credentials!")
-                st.balloons()
-                
-                # Reset registration state
-                st.session_state['registration_step'] = 'email'
-                st.session_state['pending_email'] = None
-                st.session_state['pending_password'] = None
-                
-                # Auto-switch to login tab would be nice, but we'll show a button
-                if st.button("🔑 Go to Login", type="primary"):
-                    st.rerun()
-            else:
-                st.error(f"❌ {message}")
-                # Reset and try again
-                st.session_state['registration_step'] = 'email'
-                if st.button("🔄 Try Again"):
-                    st.rerun()
 
 # Forgot Password Tab
-with t3:
+@st.fragment
+def _forgot_password_tab():
     st.markdown("#### Reset Your Password")
     
     # Multi-step password reset process
@@ -317,8 +359,7 @@ with t3:
             
             st.write("🔒 We'll send you a secure code to reset your password")
             
-            col1, col2, col3 = st.columns([1, 2, 1])
-            with col2:
+            with _centered():
                 send_reset_otp_submitted = st.form_submit_button(
                     "📧 Send Reset Code", 
                     type="primary", 
@@ -329,20 +370,21 @@ with t3:
         if send_reset_otp_submitted:
             if not reset_email:
                 st.error("❌ Please enter your email address")
+            elif not auth_manager.allow_otp_request(reset_email):
+                st.error("❌ Please wait before requesting another code")
             else:
-                with st.spinner("📧 Sending password reset code..."):
-                    success, message = auth_manager.generate_password_reset_otp(reset_email)
+                success, message = auth_manager.generate_password_reset_otp(reset_email)
                     
-                    if success:
-                        st.success(f"✅ {message}")
-                        st.info("📱 Please check your email and enter the reset code below.")
-                        
-                        # Store email for next step
-                        st.session_state['reset_email'] = reset_email
-                        st.session_state['password_reset_step'] = 'verify_otp'
-                        st.rerun()
-                    else:
-                        st.error(f"❌ {message}")
+                if success:
+                    st.success(f"✅ {message}")
+                    st.info("📱 Please check your email and enter the reset code below.")
+                    
+                    # Store email for next step
+                    st.session_state['reset_email'] = reset_email
+                    st.session_state['password_reset_step'] = 'verify_otp'
+                    st.rerun()
+                else:
+                    st.error(f"❌ {message}")
     
     # Step 2: Verify reset OTP
     elif reset_step == 'verify_otp':
@@ -377,8 +419,6 @@ with t3:
         if verify_reset_otp_submitted:
             if not reset_otp_input:
                 st.error("❌ Please enter the reset code")
-            elif len(reset_otp_input) != 6:
-                st.error("❌ Reset code must be 6 digits")
             else:
                 with st.spinner("🔍 Verifying reset code..."):
                     success, message = auth_manager.verify_password_reset_otp(
@@ -395,7 +435,9 @@ with t3:
         
         # Handle reset OTP resend
         if resend_reset_otp_submitted:
-            with st.spinner("📧 Resending reset code..."):
+            if not auth_manager.allow_otp_request(st.session_state['reset_email']):
+                st.error("❌ Please wait before requesting another code")
+            else:
                 success, message = auth_manager.generate_password_reset_otp(st.session_state['reset_email'])
                 
                 if success:
@@ -432,14 +474,9 @@ with t3:
             
             # Password requirements info
             with st.expander("🔒 Password Requirements"):
-                st.write("Your new password must contain:")
-                st.write("• At least 8 characters")
-                st.write("• At least one uppercase letter (A-Z)")
-                st.write("• At least one lowercase letter (a-z)")
-                st.write("• At least one number (0-9)")
+                st.markdown(_password_requirements_md("Your new password"))
             
-            col1, col2, col3 = st.columns([1, 2, 1])
-            with col2:
+            with _centered():
                 reset_password_submitted = st.form_submit_button(
                     "🔐 Reset Password", 
                     type="primary", 
@@ -452,6 +489,8 @@ with t3:
                 st.error("❌ Please fill in all fields")
             elif new_password != confirm_new_password:
                 st.error("❌ Passwords do not match")
+            elif not (password_check := validate_password_strength(new_password))[0]:
+                st.error(f"❌ {password_check[1]}")
             else:
                 with st.spinner("🔐 Resetting your password..."):
                     success, message = auth_manager.reset_password(
@@ -474,6 +513,13 @@ with t3:
                     else:
                         st.error(f"❌ {message}")
 
+if active_tab == 'login':
+    _login_tab()
+elif active_tab == 'register':
+    _register_tab()
+else:
+    _forgot_password_tab()
+
 # Footer
 st.markdown("---")
 st.markdown(
@@ -1,15 +1,19 @@
 import streamlit as st
-import os
 import sys
 import time
+import hashlib
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 
 # Add parent directory to path for importing utils
-parent_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-sys.path.append(parent_dir)
+parent_dir = str(Path(__file__).resolve().parents[1])
+if parent_dir not in sys.path:
+    sys.path.insert(0, parent_dir)
 
-from utils.rag import process_docs
-from utils.session_state import initialize_session_state
-from utils.authentication import init_auth_session
+from utils.config import get_performance_info
+from utils.session_state import initialize_session_state, release_vector_store
+from utils.auth_session import init_auth_session, get_auth_manager, queue_session_cookie, sync_session_cookie
+from pages.chat import chat_interface
 
 # Page configuration
 st.set_page_config(
@@ -19,16 +23,6 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
-# Hide default Streamlit page navigation
-hide_pages_style = """
-    <style>
-    [data-testid="stSidebar"] [data-testid="stSidebarNav"] {
-        display: none;
-    }
-    </style>
-"""
-st.markdown(hide_pages_style, unsafe_allow_html=True)
-
 # Initialize authentication and session state
 init_auth_session()
 initialize_session_state()
@@ -36,12 +30,13 @@ initialize_session_state()
 # Simplified authentication check - only check session state
 if not st.session_state.get('authenticated', False) or not st.session_state.get('user_info'):
     st.error("🔒 Authentication required. Please login first.")
-    col1, col2, col3 = st.columns([1, 2, 1])
-    with col2:
-        if st.button("🔑 Go to Login", type="primary", use_container_width=True, key="app_login_btn"):
-            st.switch_page("main.py")
+    if st.button("🔑 Go to Login", type="primary", key="app_login_btn"):
+        st.switch_page("main.py")
     st.stop()
 
+# Store the session cookie queued by the login page
+sync_session_cookie()
+
 # Initialize page state - use session token as part of session ID to maintain consistency
 if 'page' not in st.session_state:
     st.session_state['page'] = 'upload'
@@ -51,24 +46,39 @@ user_info = st.session_state.get('user_info', {})
 user_id = user_info.get('user_id', 'unknown')
 session_token = st.session_state.get('session_token', 'no-token')
 
-# Use a hash of user_id and session_token for consistent session ID
-import hashlib
-consistent_session_id = hashlib.md5(f"{user_id}_{session_token}".encode()).hexdigest()[:12]
-st.session_state['session-id'] = consistent_session_id
+# Use a hash of user_id and session_token for consistent session ID, recomputed only when the login changes
+if 'session-id' not in st.session_state or st.session_state.get('_sid_src') != (user_id, session_token):
+    st.session_state['session-id'] = hashlib.sha256(f"{user_id}_{session_token}".encode()).hexdigest()[:12]
+    st.session_state['_sid_src'] = (user_id, session_token)
 
 # Define allowed file types
-ALLOWED_EXTENSIONS = {
+ALLOWED_EXTENSIONS = frozenset({
     '.pdf', '.docx', '.png', '.jpg', '.jpeg', '.csv', '.json', '.py', '.ipynb', '.md'
-}
-
-def validate_file_type(uploaded_file):
-    if uploaded_file is not None:
-        file_extension = uploaded_file.name.lower().split('.')[-1]
-        return f'.{file_extension}' in ALLOWED_EXTENSIONS
-    return False
+})
+ALLOWED_EXT_NO_DOT = frozenset(ext.lstrip('.') for ext in ALLOWED_EXTENSIONS)
+UPLOAD_TYPES = sorted(ALLOWED_EXT_NO_DOT)
+UPLOAD_HELP = "Supported formats: " + ", ".join(ext.upper() for ext in UPLOAD_TYPES)
 
 def get_file_extension(filename):
-    return f'.{filename.lower().split(".")[-1]}'
+    return f'.{filename.rpartition(".")[2].lower()}'
+
+_SUPPORTED_MD = (
+    "**Supported file formats:**\n\n"
+    "📄 Documents: PDF, DOCX\n\n"
+    "🖼️ Images: PNG, JPG, JPEG\n\n"
+    "📊 Data: CSV, JSON\n\n"
+    "💻 Code: PY, IPYNB\n\n"
+    "Please upload files with supported formats only."
+)
+
+def get_file_size(uploaded_file):
+    """Size in bytes without copying the upload buffer"""
+    return uploaded_file.size if hasattr(uploaded_file, 'size') else uploaded_file.getbuffer().nbytes
+
+@st.cache_resource
+def _performance_info():
+    """System introspection is fixed for the process lifetime, so probe it once"""
+    return get_performance_info()
 
 def upload_page():
     """Upload and processing page"""
@@ -83,13 +93,15 @@ def upload_page():
         # Logout button
         if st.button("🚪 Logout", type="secondary", use_container_width=True, key="app_upload_logout_btn"):
             # Logout user
-            auth_manager = st.session_state.get('auth_manager')
-            if auth_manager and 'session_token' in st.session_state:
+            if st.session_state.get('session_token'):
+                auth_manager = st.session_state.get('auth_manager') or get_auth_manager()
                 auth_manager.logout_user(st.session_state['session_token'])
             
+            release_vector_store()
+            
             # Clear all session state
-            for key in list(st.session_state.keys()):
-                del st.session_state[key]
+            st.session_state.clear()
+            queue_session_cookie(None)
             
             # Redirect to login
             st.switch_page("main.py")
@@ -109,8 +121,7 @@ def upload_page():
         
         if 'processed' in st.session_state and st.session_state['processed']:
             st.success(f"**Processed Files:** {len(st.session_state['processed'])}")
-            for file in st.session_state['processed']:
-                st.write(f"• {file}")
+            st.markdown("\n\n".join(f"• {file}" for file in st.session_state['processed']))
         
         st.divider()
         
@@ -124,18 +135,22 @@ def upload_page():
         
         # Performance info
         st.subheader("⚡ Performance")
-        try:
-            from utils.config import get_performance_info
-            perf_info = get_performance_info()
-            st.write(f"CPU Cores: {perf_info['system_cpu_count']}")
-            st.write(f"Preset: {perf_info['recommended_preset']}")
-        except ImportError:
-            st.write("Performance info unavailable")
+        perf_info = _performance_info()
+        st.write(f"CPU Cores: {perf_info['system_cpu_count']}")
+        st.write(f"Preset: {perf_info['recommended_preset']}")
+        st.toggle(
+            "Parse in separate processes",
+            value=perf_info['system_cpu_count'] > 2,
+            key="app_use_process_pool",
+            help="Parse documents outside the GIL; faster for large PDFs, code and notebooks"
+        )
 
     uploaded_files = st.file_uploader(
         "Choose files",
         accept_multiple_files=True,
-        help="Supported formats: PDF, DOCX, PNG, JPG, JPEG, CSV, JSON, PY, IPYNB"
+        type=UPLOAD_TYPES,
+        help=UPLOAD_HELP,
+        key=f"app_uploader_{st.session_state.get('uploader_key', 0)}"
     )
 
     if uploaded_files:
@@ -143,30 +158,28 @@ def upload_page():
         invalid_files = []
         
         for uploaded_file in uploaded_files:
-            if validate_file_type(uploaded_file):
+            file_ext = get_file_extension(uploaded_file.name)
+            if file_ext in ALLOWED_EXTENSIONS:
                 valid_files.append(uploaded_file)
             else:
-                invalid_files.append(uploaded_file)
+                # Keep the extension so the error listing doesn't recompute it
+                invalid_files.append((uploaded_file, file_ext))
         
         if valid_files:
             st.success(f"✅ Successfully uploaded {len(valid_files)} valid file(s):")
-            for file in valid_files:
-                file_size = len(file.getvalue()) / 1024  # Size in KB
-                st.write(f"📁 **{file.name}** ({file_size:.1f} KB)")
+            # One markdown element for the whole list instead of one element per file
+            st.markdown("\n\n".join(
+                f"📁 **{file.name}** ({get_file_size(file) / 1024:.1f} KB)" for file in valid_files
+            ))
         
         # Display error for invalid files
         if invalid_files:
             st.error("❌ Invalid file type(s) detected:")
-            for file in invalid_files:
-                file_ext = get_file_extension(file.name)
-                st.write(f"🚫 **{file.name}** - {file_ext} format is not supported")
+            st.markdown("\n\n".join(
+                f"🚫 **{file.name}** - {file_ext} format is not supported" for file, file_ext in invalid_files
+            ))
             
-            st.info("**Supported file formats:**")
-            st.write("📄 Documents: PDF, DOCX")
-            st.write("🖼️ Images: PNG, JPG, JPEG") 
-            st.write("📊 Data: CSV, JSON")
-            st.write("💻 Code: PY, IPYNB")
-            st.write("\\nPlease upload files with supported formats only.")
+            st.info(_SUPPORTED_MD)
 
         # Processing button
         if valid_files and st.button('🚀 Start Processing', type="primary", key="app_start_processing_btn"):
@@ -194,59 +207,57 @@ def upload_page():
             #         st.write("✅ Parallel image processing")
             #         st.write("✅ Connection pooling")
             
-            progress_bar = st.progress(0)
-            status_text = st.empty()
-            
             start_time = time.time()
+            processing_time = None
             
-            with st.spinner("🚀 Processing files with optimized multithreading..."):
-                status_text.text("Initializing processing...")
-                progress_bar.progress(10)
-                
+            # A single status element carries the stage labels instead of a progress bar plus a text placeholder
+            with st.status("🚀 Processing files with optimized multithreading...", expanded=True) as status:
                 try:
-                    status_text.text("Loading and processing files...")
-                    progress_bar.progress(30)
-                    
-                    # Use optimized processing
+                    # Use optimized processing; the RAG stack is only imported once processing is requested
+                    from utils.rag import process_docs
                     st.session_state['db'], st.session_state['processed'] = process_docs(
-                        session_id, valid_files, processed_files, existing_db=existing_db
+                        session_id, valid_files, processed_files, existing_db=existing_db,
+                        on_progress=lambda percent, message: status.update(label=message),
+                        executor_cls=ProcessPoolExecutor if st.session_state.get('app_use_process_pool') else ThreadPoolExecutor
                     )
-                    progress_bar.progress(90)
-                    
-                    status_text.text("Finalizing database...")
-                    progress_bar.progress(100)
                     
                     processing_time = time.time() - start_time
+                    file_count = len(valid_files)
                     
-                    if existing_db is None:
-                        st.success(f"✅ Database created successfully in {processing_time:.2f} seconds!")
-                    else: 
-                        st.success(f"✅ Database updated successfully in {processing_time:.2f} seconds!")
+                    # Cached retrievals are stale once the database has new documents
+                    if 'chatbot' in st.session_state:
+                        st.session_state['chatbot'].query_cache.clear()
                     
-                    # Show processing statistics
-                    col1, col2, col3 = st.columns(3)
-                    with col1:
-                        st.metric("Files Processed", len(valid_files))
-                    with col2:
-                        st.metric("Processing Time", f"{processing_time:.1f}s")
-                    with col3:
-                        if processing_time > 0:
-                            st.metric("Files/Second", f"{len(valid_files)/processing_time:.1f}")
-                    
-                    # Show chat button prominently
-                    st.markdown("---")
-                    col1, col2, col3 = st.columns([1, 2, 1])
-                    with col2:
-                        if st.button('💬 Start Chatting Now!', type="primary", use_container_width=True, key="app_start_chatting_btn"):
-                            st.session_state['page'] = 'chat'
-                            st.rerun()
+                    # The widget state holds the upload buffers; a new uploader key releases them on the next rerun
+                    st.session_state['uploader_key'] = st.session_state.get('uploader_key', 0) + 1
+                    status.update(label="Processing complete", state="complete", expanded=False)
                             
                 except Exception as e:
+                    status.update(label="Processing failed", state="error")
                     st.error(f"❌ Processing failed: {str(e)}")
                     st.write("Try using the performance optimizer script to adjust settings.")
-                finally:
-                    progress_bar.empty()
-                    status_text.empty()
+            
+            if processing_time is not None:
+                if existing_db is None:
+                    st.success(f"✅ Database created successfully in {processing_time:.2f} seconds!")
+                else: 
+                    st.success(f"✅ Database updated successfully in {processing_time:.2f} seconds!")
+                
+                # Show processing statistics as one table instead of three columns of metrics
+                st.dataframe(
+                    {
+                        "Files Processed": [file_count],
+                        "Processing Time (s)": [round(processing_time, 1)],
+                        "Files/Second": [round(file_count / processing_time, 1) if processing_time > 0 else None]
+                    },
+                    hide_index=True
+                )
+                
+                # Show chat button prominently
+                st.markdown("---")
+                if st.button('💬 Start Chatting Now!', type="primary", use_container_width=True, key="app_start_chatting_btn"):
+                    st.session_state['page'] = 'chat'
+                    st.rerun()
 
     # Display upload instructions when no files are uploaded
     else:
@@ -276,9 +287,7 @@ def upload_page():
 
 def chat_page():
     """Chat interface page"""
-    # Import and show the chat interface directly
     # The chat interface handles its own sidebar content
-    from pages.chat import chat_interface
     chat_interface()
 
 
@@ -2,21 +2,31 @@ import streamlit as st
 import os
 import sys
 import time
-from typing import List, Dict, Any
-import os
+import re
+import hashlib
+import orjson
+import io
+import string
+from typing import List, Dict, Any, Tuple
+from functools import lru_cache
+from collections import deque
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 
 # load_dotenv()
 
 # Add parent directory to path for importing utils
 parent_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-sys.path.append(parent_dir)
+if parent_dir not in sys.path:
+    sys.path.insert(0, parent_dir)
 
-from utils.embeddings import TextEmbeddings
-from utils.rag import get_db
-from utils.session_state import initialize_session_state
-from utils.authentication import init_auth_session
+from utils.session_state import initialize_session_state, release_vector_store
+from utils.auth_session import init_auth_session, get_auth_manager, queue_session_cookie
+from utils.query_cache import QueryCache
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 # Page configuration
 st.set_page_config(
@@ -26,16 +36,6 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
-# Hide default Streamlit page navigation
-hide_pages_style = """
-    <style>
-    [data-testid="stSidebar"] [data-testid="stSidebarNav"] {
-        display: none;
-    }
-    </style>
-"""
-st.markdown(hide_pages_style, unsafe_allow_html=True)
-
 # Initialize authentication and session state
 init_auth_session()
 initialize_session_state()
@@ -54,10 +54,74 @@ user_info = st.session_state.get('user_info', {})
 user_id = user_info.get('user_id', 'unknown')
 session_token = st.session_state.get('session_token', 'no-token')
 
-# Use a hash of user_id and session_token for consistent session ID
-import hashlib
-consistent_session_id = hashlib.md5(f"{user_id}_{session_token}".encode()).hexdigest()[:12]
-st.session_state['session-id'] = consistent_session_id
+# Use a hash of user_id and session_token for consistent session ID, recomputed only when the login changes
+if 'session-id' not in st.session_state or st.session_state.get('_sid_src') != (user_id, session_token):
+    st.session_state['session-id'] = hashlib.sha256(f"{user_id}_{session_token}".encode()).hexdigest()[:12]
+    st.session_state['_sid_src'] = (user_id, session_token)
+
+def _fingerprint(text: str) -> bytes:
+    """Fixed-size digest of a chunk, cheaper to store and compare than the text itself"""
+    return hashlib.blake2b(text.encode('utf-8', 'ignore'), digest_size=16).digest()
+
+@st.cache_resource
+def _http_session():
+    """Keep-alive session shared across reruns so each chat turn skips the TCP/TLS handshake"""
+    session = requests.Session()
+    session.mount('https://', HTTPAdapter(
+        pool_connections=4,
+        pool_maxsize=8,
+        # Only failed connects are retried: a generation POST that reached the server may already be running
+        max_retries=Retry(total=2, connect=2, read=0, status=0, backoff_factor=0.2)
+    ))
+    return session
+
+_HTTP = _http_session()
+
+@st.cache_resource
+def _search_pool():
+    """Shared pool for concurrent vector searches; the HNSW search releases the GIL"""
+    return ThreadPoolExecutor(max_workers=4, thread_name_prefix="chat-search")
+
+# Query-variation patterns, compiled once instead of rescanning the lowered query per keyword
+_QUESTION_RE = re.compile(r'^\s*(what|how|why|when|where|who)\b', re.IGNORECASE)
+_INSTRUCTION_RE = re.compile(r'\b(explain|describe)\b\s*(.*)', re.IGNORECASE | re.DOTALL)
+
+
+# Relevance cut-off for retrieved chunks. The collection uses the "ip" space over unit vectors, so
+# distance = 1 - cosine similarity; 0.75 keeps the old squared-L2 threshold of 1.5 (cosine > 0.25)
+MAX_CONTEXT_DISTANCE = 0.75
+
+# Query-type keywords, matched against the query's words in one pass
+_WORD_RE = re.compile(r"[a-z]+")
+_SUMMARY_WORDS = frozenset({'summarize', 'summary', 'overview'})
+_COMPARISON_WORDS = frozenset({'compare', 'difference', 'versus', 'vs'})
+_FACTUAL_WORDS = frozenset({'what', 'when', 'where', 'who'})
+_EXPLANATION_WORDS = frozenset({'how', 'why', 'explain'})
+
+# Static prompt scaffold, parsed once per process instead of reformatting the whole f-string per turn.
+# First turns use the variant without the empty "Previous conversation" block.
+_PROMPT_HEAD = "You are a helpful AI assistant that answers questions based on provided document context.\n\n"
+_PROMPT_BODY = """Context from documents:
+$context
+
+Current question: $query
+
+Task: $task
+
+Instructions:
+1. Base your answer primarily on the provided context
+2. If the context is insufficient, clearly state what information is missing
+3. Be accurate and cite specific details from the context when relevant
+4. Structure your response clearly with bullet points or numbered lists when appropriate
+5. If this relates to previous conversation, acknowledge the connection
+6. Keep responses focused and informative
+
+Answer:"""
+_PROMPT_TEMPLATE = string.Template(_PROMPT_HEAD + "Previous conversation:\n$history\n\n" + _PROMPT_BODY)
+_PROMPT_NO_HISTORY_TEMPLATE = string.Template(_PROMPT_HEAD + _PROMPT_BODY)
+
+# Upper bound on context characters sent to the LLM per turn
+MAX_PROMPT_CONTEXT_CHARS = 6000
 
 
 class RAGChatbot:
@@ -66,116 +130,158 @@ class RAGChatbot:
     def __init__(self, database, embedding_function):
         self.database = database
         self.embedding_function = embedding_function
-        self.conversation_history = []
+        self.conversation_history = deque(maxlen=64)  # Bounded; only the last few exchanges reach the prompt
+        self.query_cache = QueryCache(max_size=256, ttl_seconds=600)
+        # Repeated questions (including the example buttons) reuse their query embedding
+        self._cached_query_embedding = lru_cache(maxsize=512)(
+            lambda text: tuple(self.embedding_function.embed_query(text))
+        )
+    
+    def embed_query(self, text: str) -> List[float]:
+        """Embed a query string, memoized per chatbot"""
+        return list(self._cached_query_embedding(text))
         
-    def retrieve_context(self, query: str, k: int = 5) -> List[str]:
+    def retrieve_context(self, query: str, k: int = 5, query_embedding: List[float] = None) -> List[str]:
         """Retrieve relevant context from the database using enhanced search"""
         if not self.database:
             return []
         
         try:
-            # Use similarity search with score threshold
-            results = self.database.similarity_search_with_score(query, k=k)
+            # Use similarity search with score threshold; reuse the query embedding when the caller has one
+            if query_embedding is not None:
+                results = self.database.similarity_search_by_vector_with_relevance_scores(query_embedding, k=k)
+            else:
+                results = self.database.similarity_search_with_score(query, k=k)
             
             # Filter results by relevance score (lower score = more similar)
             context_chunks = []
             for doc, score in results:
                 # Only include documents with decent relevance (adjust threshold as needed)
-                if score < 1.5:  # ChromaDB uses distance, so lower is better
+                if score < MAX_CONTEXT_DISTANCE:  # ChromaDB uses distance, so lower is better
                     context_chunks.append(doc.page_content)
             
-            # If no good matches, try a broader search
+            # If no good matches, fall back to the closest few results already fetched
             if not context_chunks:
-                fallback_results = self.database.similarity_search(query, k=min(k, 3))
-                context_chunks = [doc.page_content for doc in fallback_results]
+                context_chunks = [doc.page_content for doc, _ in results[:min(k, 3)]]
             
             return context_chunks
         except Exception as e:
             st.error(f"Error retrieving context: {e}")
             return []
     
-    def get_sources(self, query: str, k: int = 3) -> List[Dict]:
-        """Get source information for retrieved documents"""
-        if not self.database:
-            return []
-        
+    def retrieve_context_batch(self, query_embeddings: List[List[float]], k: int = 5) -> Tuple[List[str], List[Tuple]]:
+        """Retrieve context plus every (distance, content, metadata) match with a single ChromaDB query"""
         try:
-            results = self.database.similarity_search_with_score(query, k=k)
-            sources = []
-            for doc, score in results:
-                source_info = {
-                    'content': doc.page_content[:200] + "..." if len(doc.page_content) > 200 else doc.page_content,
-                    'metadata': doc.metadata,
-                    'relevance_score': float(score)
-                }
-                sources.append(source_info)
-            return sources
+            collection = getattr(self.database, '_collection', None)
+            if collection is not None:
+                results = collection.query(
+                    query_embeddings=query_embeddings,
+                    n_results=k,
+                    include=["documents", "metadatas", "distances"]
+                )
+                per_query = zip(results['documents'], results['metadatas'], results['distances'])
+            else:
+                # No native collection to batch against: overlap the per-variation searches instead
+                futures = [
+                    _search_pool().submit(self.database.similarity_search_by_vector_with_relevance_scores, embedding, k=k)
+                    for embedding in query_embeddings
+                ]
+                per_query = []
+                for future in futures:
+                    pairs = future.result()
+                    per_query.append((
+                        [doc.page_content for doc, _ in pairs],
+                        [doc.metadata for doc, _ in pairs],
+                        [score for _, score in pairs]
+                    ))
+            
+            context_chunks = []
+            matches = []
+            for documents, metadatas, distances in per_query:
+                # Same relevance threshold as retrieve_context, falling back to the closest few
+                relevant = [doc for doc, distance in zip(documents, distances) if distance < MAX_CONTEXT_DISTANCE]
+                context_chunks.extend(relevant or documents[:min(k, 3)])
+                matches.extend(zip(distances, documents, metadatas))
+            
+            return context_chunks, matches
         except Exception as e:
-            st.error(f"Error getting sources: {e}")
-            return []
+            st.error(f"Error retrieving context: {e}")
+            return [], []
+    
+    def get_sources(self, query: str, k: int = 3) -> List[Dict]:
+        """Get source information for retrieved documents"""
+        return self.retrieve_enhanced_context(query, sources_k=k)[1]
     
     def enhance_query(self, query: str) -> List[str]:
         """Generate additional search queries to improve context retrieval"""
         enhanced_queries = [query]  # Start with original query
         
-        # Add some query variations for better retrieval
-        query_lower = query.lower()
-        
-        # If it's a question, also search for declarative statements
-        if query_lower.startswith(('what', 'how', 'why', 'when', 'where', 'who')):
-            # Extract key terms from the question
-            key_terms = query.split()[1:]  # Skip question word
+        # If it's a question, also search for declarative statements (key terms without the question word)
+        if _QUESTION_RE.match(query):
+            key_terms = query.split()[1:]
             if key_terms:
                 enhanced_queries.append(' '.join(key_terms))
         
-        # Add keyword-based variations
-        if 'explain' in query_lower or 'describe' in query_lower:
-            topic = query_lower.replace('explain', '').replace('describe', '').strip()
-            enhanced_queries.append(topic)
+        # Add keyword-based variations: the topic following "explain"/"describe"
+        instruction = _INSTRUCTION_RE.search(query)
+        if instruction and instruction.group(2).strip():
+            enhanced_queries.append(instruction.group(2).strip())
         
         return enhanced_queries
 
-    def retrieve_enhanced_context(self, query: str, k: int = 5) -> List[str]:
-        """Retrieve context using multiple query variations"""
+    def retrieve_enhanced_context(self, query: str, k: int = 5, sources_k: int = 3) -> Tuple[List[str], List[Dict]]:
+        """Retrieve context and its top sources using multiple query variations"""
         if not self.database:
-            return []
+            return [], []
         
-        all_contexts = []
+        # Embed the query once and serve near-duplicate questions from the semantic cache
+        query_embedding = self.embed_query(query)
+        cached = self.query_cache.get(query_embedding)
+        if cached is not None and cached[0] >= k and cached[1] >= sources_k:
+            return cached[2][:k], cached[3][:sources_k]
+        
+        # Embed the remaining variations together and search them all in one collection query
         enhanced_queries = self.enhance_query(query)
+        query_embeddings = [query_embedding]
+        if len(enhanced_queries) > 1:
+            query_embeddings.extend(self.embedding_function.embed_documents(enhanced_queries[1:]))
+        all_contexts, matches = self.retrieve_context_batch(query_embeddings, k=k//len(enhanced_queries) + 1)
         
-        for enhanced_query in enhanced_queries:
-            contexts = self.retrieve_context(enhanced_query, k=k//len(enhanced_queries) + 1)
-            all_contexts.extend(contexts)
+        # Remove duplicates while preserving order (dicts keep first-insertion order), keyed on a 16-byte digest
+        unique_contexts = list(dict(zip(map(_fingerprint, all_contexts), all_contexts)).values())
         
-        # Remove duplicates while preserving order
+        # Sources are the closest distinct matches from the same search, no second query needed
         seen = set()
-        unique_contexts = []
-        for context in all_contexts:
-            if context not in seen:
-                seen.add(context)
-                unique_contexts.append(context)
-        
-        return unique_contexts[:k]  # Limit to requested number
+        sources = []
+        for distance, content, metadata in sorted(matches, key=lambda match: match[0]):
+            digest = _fingerprint(content)
+            if digest in seen:
+                continue
+            seen.add(digest)
+            sources.append({
+                'content': content[:200] + "..." if len(content) > 200 else content,
+                'metadata': metadata or {},
+                'relevance_score': float(distance)
+            })
+            if len(sources) == sources_k:
+                break
+        
+        self.query_cache.put(query_embedding, (k, sources_k, unique_contexts[:k], sources))
+        return unique_contexts[:k], sources  # Limit to requested number
 
-    def generate_response(self, query: str, context: List[str]) -> str:
-        """Generate response using the LLM with retrieved context"""
+    def build_prompt(self, query: str, context: List[str]) -> str:
+        """Build the LLM prompt from the retrieved context and recent conversation"""
         
         # Prepare the prompt with context
-        context_text = "\n\n".join(context) if context else "No relevant context found."
-        
-        # Include conversation history for continuity
-        conversation_context = ""
-        if self.conversation_history:
-            recent_history = self.conversation_history[-3:]  # Last 3 exchanges
-            for exchange in recent_history:
-                conversation_context += f"Human: {exchange['user']}\nAssistant: {exchange['bot']}\n\n"
+        context_text = "\n\n".join(context)[:MAX_PROMPT_CONTEXT_CHARS] if context else "No relevant context found."
         
         # Analyze query type for better prompting
         query_lower = query.lower()
-        is_summary = any(word in query_lower for word in ['summarize', 'summary', 'overview', 'main points'])
-        is_comparison = any(word in query_lower for word in ['compare', 'difference', 'versus', 'vs'])
-        is_factual = any(word in query_lower for word in ['what', 'when', 'where', 'who'])
-        is_explanation = any(word in query_lower for word in ['how', 'why', 'explain'])
+        tokens = set(_WORD_RE.findall(query_lower))
+        is_summary = bool(tokens & _SUMMARY_WORDS) or 'main points' in query_lower
+        is_comparison = bool(tokens & _COMPARISON_WORDS)
+        is_factual = bool(tokens & _FACTUAL_WORDS)
+        is_explanation = bool(tokens & _EXPLANATION_WORDS)
         
         # Customize instructions based on query type
         if is_summary:
@@ -187,68 +293,77 @@ class RAGChatbot:
         else:
             task_instruction = "Answer the question directly using information from the context."
 
-        prompt = f"""You are a helpful AI assistant that answers questions based on provided document context.
-
-Previous conversation:
-{conversation_context}
-
-Context from documents:
-{context_text}
-
-Current question: {query}
-
-Task: {task_instruction}
-
-Instructions:
-1. Base your answer primarily on the provided context
-2. If the context is insufficient, clearly state what information is missing
-3. Be accurate and cite specific details from the context when relevant
-4. Structure your response clearly with bullet points or numbered lists when appropriate
-5. If this relates to previous conversation, acknowledge the connection
-6. Keep responses focused and informative
-
-Answer:"""
+        # First turn: skip the empty "Previous conversation" block entirely
+        if not self.conversation_history:
+            return _PROMPT_NO_HISTORY_TEMPLATE.substitute(context=context_text, query=query, task=task_instruction)
+        
+        # Include conversation history for continuity
+        buffer = io.StringIO()
+        recent_history = islice(self.conversation_history, max(0, len(self.conversation_history) - 3), None)  # Last 3 exchanges
+        for exchange in recent_history:
+            buffer.write("Human: ")
+            buffer.write(exchange['user'])
+            buffer.write("\nAssistant: ")
+            buffer.write(exchange['bot'])
+            buffer.write("\n\n")
+        
+        return _PROMPT_TEMPLATE.substitute(
+            history=buffer.getvalue(),
+            context=context_text,
+            query=query,
+            task=task_instruction
+        )
+    
+    def stream_response(self, query: str, context: List[str]):
+        """Yield the LLM response piece by piece as the model generates it"""
+        prompt = self.build_prompt(query, context)
         
         try:
-            # Make request to the LLM API
-            response = requests.post(
+            # Make a streaming request to the LLM API; the body is NDJSON, one object per generated chunk
+            with _HTTP.post(
                 url="https://aihub-vvitu.social/api/ollama-api/generate/",
                 headers={'API-KEY': st.secrets.get('OLLAMA-API-KEY')},
                 # headers={'API-KEY': os.getenv('OLLAMA-API-KEY')},
                 json={
                     "model": "gpt-oss:20b",  # Using a text generation model
                     "prompt": prompt,
-                    "stream": False,
+                    "stream": True,
                     "options": {
                         "temperature": 0.7,
                         "top_p": 0.9,
                         "max_tokens": 1000
                     }
                 },
-                timeout=30
-            )
-            
-            if response.status_code == 200:
-                return response.json()['response']
-            else:
-                return f"Error: Failed to get response from AI model (Status: {response.status_code})"
+                timeout=30,
+                stream=True
+            ) as response:
+                if response.status_code != 200:
+                    yield f"Error: Failed to get response from AI model (Status: {response.status_code})"
+                    return
+                
+                for line in response.iter_lines():
+                    if line:
+                        yield orjson.loads(line).get('response', '')
                 
         except requests.exceptions.Timeout:
-            return "Error: Request timed out. Please try again."
+            yield "Error: Request timed out. Please try again."
         except Exception as e:
-            return f"Error generating response: {str(e)}"
+            yield f"Error generating response: {str(e)}"
+    
+    def generate_response(self, query: str, context: List[str]) -> str:
+        """Generate response using the LLM with retrieved context"""
+        return "".join(self.stream_response(query, context))
     
     def chat(self, user_message: str) -> Dict[str, Any]:
         """Main chat function that orchestrates the RAG process"""
         
         # Step 1: Retrieve relevant context using enhanced search
         with st.spinner("🔍 Searching through your documents..."):
-            context = self.retrieve_enhanced_context(user_message, k=7)  # Get more context for better responses
-            sources = self.get_sources(user_message)
+            context, sources = self.retrieve_enhanced_context(user_message, k=7)  # Get more context for better responses
         
-        # Step 2: Generate response
-        with st.spinner("🤖 Generating response..."):
-            bot_response = self.generate_response(user_message, context)
+        # Step 2: Stream the response into the assistant message as it is generated
+        with st.chat_message("assistant", avatar="🤖"):
+            bot_response = st.write_stream(self.stream_response(user_message, context))
         
         # Step 3: Store conversation history
         self.conversation_history.append({
@@ -266,6 +381,19 @@ Answer:"""
         }
 
 
+# Extension -> index into the (pdf, code, data, images) flags used for example questions
+_FILE_TYPE_INDEX = {'pdf': 0, 'py': 1, 'ipynb': 1, 'csv': 2, 'json': 2, 'jpg': 3, 'png': 3, 'jpeg': 3}
+
+def get_file_type_flags(files: List[str]) -> Tuple[bool, bool, bool, bool]:
+    """Single pass over the processed files to find which kinds of documents are present"""
+    flags = [False, False, False, False]
+    for file in files:
+        index = _FILE_TYPE_INDEX.get(file.rpartition('.')[2].lower())
+        if index is not None:
+            flags[index] = True
+    return tuple(flags)
+
+
 def display_chat_message(message: str, is_user: bool = True):
     """Display a chat message with proper styling"""
     if is_user:
@@ -276,10 +404,14 @@ def display_chat_message(message: str, is_user: bool = True):
             st.write(message)
 
 
-def display_sources(sources: List[Dict], expanded: bool = False):
+def display_sources(sources, expanded: bool = False):
     """Display source information in an expandable section"""
     if not sources:
         return
+    
+    # Chat history keeps sources as orjson bytes
+    if isinstance(sources, bytes):
+        sources = orjson.loads(sources)
         
     with st.expander(f"📚 Sources ({len(sources)} documents)", expanded=expanded):
         for i, source in enumerate(sources):
@@ -314,6 +446,8 @@ def chat_interface():
     
     # Initialize chatbot
     if 'chatbot' not in st.session_state:
+        # The embeddings module pulls in chromadb/langchain, so only load it when a chatbot is built
+        from utils.embeddings import TextEmbeddings
         embedding_fn = TextEmbeddings()
         st.session_state['chatbot'] = RAGChatbot(st.session_state['db'], embedding_fn)
     
@@ -323,13 +457,15 @@ def chat_interface():
         # Logout button
         if st.button("🚪 Logout", type="secondary", use_container_width=True, key="chat_sidebar_logout_btn"):
             # Logout user
-            auth_manager = st.session_state.get('auth_manager')
-            if auth_manager and 'session_token' in st.session_state:
+            if st.session_state.get('session_token'):
+                auth_manager = st.session_state.get('auth_manager') or get_auth_manager()
                 auth_manager.logout_user(st.session_state['session_token'])
             
+            release_vector_store()
+            
             # Clear all session state
-            for key in list(st.session_state.keys()):
-                del st.session_state[key]
+            st.session_state.clear()
+            queue_session_cookie(None)
             
             # Redirect to login
             st.switch_page("main.py")
@@ -353,11 +489,6 @@ def chat_interface():
         
         st.write(f"**Session ID:** `{st.session_state.get('session-id', 'Unknown')}`")
         
-        # Chat statistics
-        if hasattr(st.session_state.get('chatbot'), 'conversation_history'):
-            chat_count = len(st.session_state['chatbot'].conversation_history)
-            st.write(f"**Messages Exchanged:** {chat_count}")
-        
         st.divider()
         
         # Navigation
@@ -372,16 +503,26 @@ def chat_interface():
         # Reset conversation button
         if st.button("🔄 Clear Chat History", use_container_width=True, key="chat_clear_history_btn"):
             if 'chatbot' in st.session_state:
-                st.session_state['chatbot'].conversation_history = []
+                st.session_state['chatbot'].conversation_history.clear()
             if 'chat_history' in st.session_state:
                 st.session_state['chat_history'] = []
             st.success("Chat history cleared!")
             st.rerun()
     
+    _conversation()
+
+
+@st.fragment
+def _conversation():
+    """Chat history, input and examples; reruns on its own so a turn doesn't re-execute the whole page"""
     # Initialize chat history in session state
     if 'chat_history' not in st.session_state:
         st.session_state['chat_history'] = []
     
+    # Chat statistics live inside the fragment so they refresh with each turn (a fragment can't update the sidebar);
+    # the slot sits at the top but is filled after this run's turn, so the counts include it
+    stats_placeholder = st.empty()
+    
     # Display chat history
     chat_container = st.container()
     with chat_container:
@@ -415,13 +556,10 @@ def chat_interface():
         # Display user message immediately
         display_chat_message(user_message, is_user=True)
         
-        # Get bot response
+        # Get bot response; chat() streams it into the page as it is generated
         chatbot = st.session_state['chatbot']
         result = chatbot.chat(user_message.strip())
         
-        # Display bot response
-        display_chat_message(result['response'], is_user=False)
-        
         # Display sources
         if result['sources']:
             display_sources(result['sources'])
@@ -430,7 +568,7 @@ def chat_interface():
         chat_entry = {
             'user': user_message.strip(),
             'bot': result['response'],
-            'sources': result['sources'],
+            'sources': orjson.dumps(result['sources']) if result['sources'] else None,  # Decoded only when rendered
             'timestamp': time.time()
         }
         st.session_state['chat_history'].append(chat_entry)
@@ -443,9 +581,14 @@ def chat_interface():
             st.metric("📚 Sources Found", len(result['sources']))
         with col3:
             st.metric("💬 Total Exchanges", result['conversation_length'])
-        
-        # Rerun to update the chat display
-        st.rerun()
+    
+    chatbot = st.session_state.get('chatbot')
+    if hasattr(chatbot, 'conversation_history') and hasattr(chatbot, 'query_cache'):
+        cache_stats = chatbot.query_cache.stats()
+        stats_placeholder.caption(
+            f"💬 Messages Exchanged: {len(chatbot.conversation_history)} · "
+            f"Query Cache: {cache_stats['hits']} hits / {cache_stats['misses']} misses"
+        )
     
     # Example questions
     if not st.session_state['chat_history']:
@@ -455,13 +598,12 @@ def chat_interface():
         
         # Get processed file types to suggest relevant questions
         if 'processed' in st.session_state and st.session_state['processed']:
+            # Check file types once per change to the processed list rather than on every rerun
             files = st.session_state['processed']
-            
-            # Check file types
-            has_pdf = any(f.endswith('.pdf') for f in files)
-            has_code = any(f.endswith(('.py', '.ipynb')) for f in files)
-            has_data = any(f.endswith(('.csv', '.json')) for f in files)
-            has_images = any(f.endswith(('.jpg', '.png', '.jpeg')) for f in files)
+            if st.session_state.get('suffix_flags_count') != len(files):
+                st.session_state['suffix_flags'] = get_file_type_flags(files)
+                st.session_state['suffix_flags_count'] = len(files)
+            has_pdf, has_code, has_data, has_images = st.session_state['suffix_flags']
             
             if has_pdf:
                 example_questions.extend([
@@ -500,10 +642,10 @@ def chat_interface():
             ]
         
         for idx, question in enumerate(example_questions):
-            if st.button(f"💭 {question}", key=f"chat_example_{idx}_{hash(question)}"):
+            if st.button(f"💭 {question}", key=f"chat_example_{idx}"):
                 # Trigger the question as if user typed it
                 st.session_state['auto_question'] = question
-                st.rerun()
+                st.rerun(scope="fragment")
     
     # Handle auto-triggered questions
     if 'auto_question' in st.session_state:
@@ -512,10 +654,9 @@ def chat_interface():
         # Display user message
         display_chat_message(question, is_user=True)
         
-        # Get and display bot response
+        # Get bot response; chat() streams it into the page as it is generated
         chatbot = st.session_state['chatbot']
         result = chatbot.chat(question)
-        display_chat_message(result['response'], is_user=False)
         
         if result['sources']:
             display_sources(result['sources'])
@@ -524,12 +665,12 @@ def chat_interface():
         chat_entry = {
             'user': question,
             'bot': result['response'],
-            'sources': result['sources'],
+            'sources': orjson.dumps(result['sources']) if result['sources'] else None,  # Decoded only when rendered
             'timestamp': time.time()
         }
         st.session_state['chat_history'].append(chat_entry)
         
-        st.rerun()
+        st.rerun(scope="fragment")
 
 
 if __name__ == "__main__":
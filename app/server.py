@@ -0,0 +1,60 @@
+import os
+import sys
+from urllib.parse import urlsplit
+
+from starlette.responses import Response
+from starlette.routing import Route
+from streamlit.starlette import App
+
+# Add parent directory to path for importing utils
+parent_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(parent_dir)
+
+from utils.auth_session import SESSION_COOKIE_NAME, SESSION_COOKIE_MAX_AGE, SESSION_COOKIE_PATH, unsign_session_token
+
+
+def _same_origin(request) -> bool:
+    """Reject requests a browser sent on behalf of another site"""
+    origin = request.headers.get("origin")
+    return origin is None or urlsplit(origin).netloc == request.url.netloc
+
+
+async def session_cookie(request):
+    """Store (POST) or clear (DELETE) the signed session token as an HttpOnly cookie"""
+    # Cross-site forms cannot send JSON without a preflight, so another site cannot plant its own login here
+    if not _same_origin(request):
+        return Response(status_code=403)
+
+    response = Response(status_code=204)
+    if request.method == "DELETE":
+        response.delete_cookie(SESSION_COOKIE_NAME, path="/")
+        return response
+
+    if request.headers.get("content-type") != "application/json":
+        return Response(status_code=415)
+    try:
+        signed_token = (await request.json()).get("token")
+    except ValueError:
+        return Response(status_code=400)
+
+    # Only a token carrying our signature is stored; the login page re-validates the session itself on every read
+    if not isinstance(signed_token, str) or not unsign_session_token(signed_token):
+        return Response(status_code=400)
+
+    response.set_cookie(
+        SESSION_COOKIE_NAME,
+        signed_token,
+        path="/",
+        httponly=True,
+        secure=True,
+        samesite="lax",
+        max_age=SESSION_COOKIE_MAX_AGE
+    )
+    return response
+
+
+# Run with: uvicorn app.server:app --host 0.0.0.0 --port 8501 (see README)
+app = App(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py"),
+    routes=[Route(SESSION_COOKIE_PATH, session_cookie, methods=["POST", "DELETE"])]
+)
@@ -0,0 +1,185 @@
+# Lightweight session helpers: pages can check an existing session without
+# importing the SMTP/SQLite authentication stack in utils.authentication
+import hashlib
+import hmac
+import json
+import os
+import secrets
+import threading
+import time
+import streamlit as st
+import streamlit.components.v1 as components
+
+# Name and lifetime of the browser cookie carrying the signed session token
+SESSION_COOKIE_NAME = "session_token"
+SESSION_COOKIE_MAX_AGE = 7 * 24 * 60 * 60  # Matches the 7-day session expiry
+SESSION_COOKIE_PATH = "/api/session"  # Endpoint in app/server.py that sets and clears the cookie
+_SESSION_SECRET = None
+
+# Validated sessions shared across reruns: session_token -> (user_info, expires_at timestamp)
+_SESSION_CACHE: dict = {}
+_SESSION_CACHE_LOCK = threading.Lock()
+
+def _get_session_secret() -> bytes:
+    """Get the key used to sign session cookies (random per process if not configured)"""
+    global _SESSION_SECRET
+    if _SESSION_SECRET is None:
+        try:
+            secret = st.secrets.get('SESSION_SECRET') or os.getenv('SESSION_SECRET')
+        except Exception:
+            secret = os.getenv('SESSION_SECRET')
+        _SESSION_SECRET = secret.encode() if secret else secrets.token_bytes(32)
+    return _SESSION_SECRET
+
+def _get_cached_session(session_token: str):
+    """Return cached user info for a session token, or None if missing or expired"""
+    with _SESSION_CACHE_LOCK:
+        entry = _SESSION_CACHE.get(session_token)
+        if entry is None:
+            return None
+        user_info, expires_at = entry
+        if time.time() >= expires_at:
+            del _SESSION_CACHE[session_token]
+            return None
+        return user_info
+
+def _cache_session(session_token: str, user_info: dict):
+    """Remember a validated session until it expires"""
+    expires_ts = user_info.get('expires_at')
+    if expires_ts is None:
+        return
+    with _SESSION_CACHE_LOCK:
+        _SESSION_CACHE[session_token] = (user_info, expires_ts)
+
+def _invalidate_cached_sessions(session_token: str = None, user_id: int = None, email: str = None):
+    """Drop cached sessions by token, user id, or email"""
+    with _SESSION_CACHE_LOCK:
+        if session_token is not None:
+            _SESSION_CACHE.pop(session_token, None)
+        if user_id is not None or email is not None:
+            for token, (user_info, _) in list(_SESSION_CACHE.items()):
+                if user_info.get('user_id') == user_id or (email and user_info.get('email') == email.lower()):
+                    del _SESSION_CACHE[token]
+
+def sign_session_token(session_token: str) -> str:
+    """Sign a session token for storage in a cookie"""
+    signature = hmac.new(_get_session_secret(), session_token.encode(), hashlib.sha256).hexdigest()
+    return f"{session_token}.{signature}"
+
+def unsign_session_token(signed_token: str):
+    """Return the session token if the cookie signature is valid, else None"""
+    session_token, _, signature = signed_token.rpartition('.')
+    if not session_token:
+        return None
+    expected = hmac.new(_get_session_secret(), session_token.encode(), hashlib.sha256).hexdigest()
+    if not hmac.compare_digest(signature, expected):
+        return None
+    return session_token
+
+def queue_session_cookie(session_token: str = None):
+    """Have the next rendered page store the signed token as a cookie, or clear the cookie when None"""
+    st.session_state['_session_cookie'] = sign_session_token(session_token) if session_token else ''
+
+def sync_session_cookie():
+    """Send a queued cookie update to the server from the browser, so it arrives as a real HTTP response"""
+    signed_token = st.session_state.pop('_session_cookie', None)
+    if signed_token is None:
+        return
+    
+    # The token travels in a same-origin POST body, never in the URL
+    if signed_token:
+        request = {'method': 'POST', 'headers': {'Content-Type': 'application/json'}, 'body': json.dumps({'token': signed_token})}
+    else:
+        request = {'method': 'DELETE'}
+    request['credentials'] = 'same-origin'
+    components.html(f"<script>fetch({json.dumps(SESSION_COOKIE_PATH)}, {json.dumps(request)});</script>", height=0)
+
+def validate_password_strength(password: str) -> tuple:
+    """Validate password strength"""
+    if len(password) < 8:
+        return False, "Password must be at least 8 characters long"
+    
+    # Collect every character class in a single pass over the password
+    has_upper = has_lower = has_digit = False
+    for c in password:
+        has_upper |= c.isupper()
+        has_lower |= c.islower()
+        has_digit |= c.isdigit()
+    
+    if not has_upper:
+        return False, "Password must contain at least one uppercase letter"
+    
+    if not has_lower:
+        return False, "Password must contain at least one lowercase letter"
+    
+    if not has_digit:
+        return False, "Password must contain at least one number"
+    
+    return True, "Password is valid"
+
+# Streamlit integration functions
+@st.cache_resource
+def get_auth_manager():
+    """Get the process-wide AuthManager (holds only config and DB access, no per-user data)"""
+    # Imported lazily so already-authenticated reruns never load the SMTP/SQLite auth stack
+    from .authentication import AuthManager
+    return AuthManager()
+
+def init_auth_session():
+    """Initialize authentication session state"""
+    if 'authenticated' not in st.session_state:
+        st.session_state['authenticated'] = False
+    if 'user_info' not in st.session_state:
+        st.session_state['user_info'] = None
+    if 'registration_step' not in st.session_state:
+        st.session_state['registration_step'] = 'email'  # email -> otp
+    if 'pending_email' not in st.session_state:
+        st.session_state['pending_email'] = None
+    # Add these new lines for password reset functionality
+    if 'password_reset_step' not in st.session_state:
+        st.session_state['password_reset_step'] = 'email'  # email -> verify_otp -> new_password
+    if 'reset_email' not in st.session_state:
+        st.session_state['reset_email'] = None
+
+def require_auth():
+    """Decorator to require authentication for a function"""
+    def decorator(func):
+        def wrapper(*args, **kwargs):
+            if not st.session_state.get('authenticated', False):
+                st.error("🔒 Please login to access this feature")
+                st.stop()
+            return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def check_session():
+    """Check if current session is valid"""
+    if 'session_token' in st.session_state and st.session_state['session_token']:
+        session_token = st.session_state['session_token']
+        
+        # Fast path: session already validated by an earlier rerun
+        user_info = _get_cached_session(session_token)
+        if user_info is not None:
+            st.session_state['authenticated'] = True
+            st.session_state['user_info'] = user_info
+            return True
+        
+        # Only fall back to the shared manager when this session has none; a .get default would be evaluated every time
+        auth_manager = st.session_state.get('auth_manager')
+        if auth_manager is None:
+            auth_manager = get_auth_manager()
+            st.session_state['auth_manager'] = auth_manager
+        is_valid, user_info = auth_manager.validate_session(session_token)
+        
+        if is_valid:
+            _cache_session(session_token, user_info)
+            st.session_state['authenticated'] = True
+            st.session_state['user_info'] = user_info
+            return True
+        else:
+            # Session expired or invalid
+            st.session_state['authenticated'] = False
+            st.session_state['user_info'] = None
+            st.session_state['session_token'] = None
+            return False
+    return False
@@ -1,37 +1,241 @@
 import sqlite3
 import hashlib
+import hmac
 import os
+import re
 from datetime import datetime, timedelta
 import secrets
+import threading
+import time
+import queue
+from contextlib import contextmanager
+from cachetools import TTLCache
+from concurrent.futures import ThreadPoolExecutor
 import streamlit as st
 import smtplib
-import random
-import string
 from dotenv import load_dotenv
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 
+from .auth_session import (
+    SESSION_COOKIE_NAME, SESSION_COOKIE_MAX_AGE, sign_session_token, unsign_session_token,
+    _invalidate_cached_sessions, get_auth_manager, init_auth_session, require_auth, check_session,
+    validate_password_strength
+)
+
 # load_dotenv()
 
+# Background pool for SMTP delivery so OTP requests don't wait on the mail server
+_EMAIL_POOL = ThreadPoolExecutor(max_workers=4, thread_name_prefix="otp-mail")
+
+# Set OTP_SYNC_EMAIL=1 to send inline and report delivery failures (useful for tests and debugging)
+SYNC_EMAIL = os.getenv('OTP_SYNC_EMAIL', '').lower() in ('1', 'true', 'yes')
+
+# Email bodies rendered with a single %s substitution for the OTP
+_OTP_TEMPLATE = """
+<html>
+<body>
+    <h2>🔐 Email Verification</h2>
+    <p>Hello,</p>
+    <p>Thank you for registering with Multimodal RAG System!</p>
+    <p>Your verification code is:</p>
+    <h1 style="color: #007bff; text-align: center; background: #f8f9fa; padding: 20px; border-radius: 5px;">
+        %s
+    </h1>
+    <p><strong>Important:</strong></p>
+    <ul>
+        <li>This code expires in 10 minutes</li>
+        <li>Don't share this code with anyone</li>
+        <li>Enter this code in the registration form to complete your account setup</li>
+    </ul>
+    <p>If you didn't request this registration, please ignore this email.</p>
+    <br>
+    <p>Best regards,<br>Multimodal RAG System Team</p>
+</body>
+</html>
+"""
+
+_RESET_TEMPLATE = """
+<html>
+<body>
+    <h2>🔐 Password Reset Request</h2>
+    <p>Hello,</p>
+    <p>We received a request to reset your password for your Multimodal RAG System account.</p>
+    <p>Your password reset verification code is:</p>
+    <h1 style="color: #dc3545; text-align: center; background: #f8f9fa; padding: 20px; border-radius: 5px; border-left: 4px solid #dc3545;">
+        %s
+    </h1>
+    <p><strong>Important Security Information:</strong></p>
+    <ul>
+        <li><strong>This code expires in 15 minutes</strong></li>
+        <li>Don't share this code with anyone</li>
+        <li>Only use this code if you requested a password reset</li>
+        <li>If you didn't request this reset, please ignore this email</li>
+    </ul>
+    <p><strong>Next Steps:</strong></p>
+    <ol>
+        <li>Return to the password reset page</li>
+        <li>Enter this verification code</li>
+        <li>Create your new secure password</li>
+    </ol>
+    <hr>
+    <p><small><strong>Security Tip:</strong> Make sure your new password is strong with at least 8 characters, including uppercase, lowercase letters, and numbers.</small></p>
+    <br>
+    <p>Best regards,<br>Multimodal RAG System Security Team</p>
+</body>
+</html>
+"""
+
+# Per-email token bucket limiting OTP requests
+OTP_RATE = 1 / 30  # One OTP every 30 seconds
+OTP_BURST = 2      # Allow up to 2 OTPs back to back
+
+# Lifetimes in seconds for registration OTPs, password reset OTPs and login sessions
+OTP_TTL = 10 * 60
+RESET_OTP_TTL = 15 * 60
+SESSION_TTL = SESSION_COOKIE_MAX_AGE
+
+# Seconds a verified password reset OTP authorizes the password change
+RESET_AUTH_TTL = 30 * 60
+
+# Seconds between background purges of expired sessions and OTPs
+SWEEP_INTERVAL = 60
+
+# Seconds an authenticated SMTP connection may sit idle before it is reopened
+SMTP_IDLE_TIMEOUT = 60
+
+# Email format, compiled once at import
+_EMAIL_RE = re.compile(r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$')
+
+# Well-formed OTP input: exactly six digits
+_OTP_RE = re.compile(r"^\d{6}$")
+
+# Schema migrations, in the order _run_migrations applies them
+MIGRATIONS = (
+    'add_is_verified_column', 'add_password_scheme_column', 'set_existing_users_verified',
+    'unique_active_otp_per_email', 'add_expires_at_ts', 'add_user_count_stats', 'add_otp_type_column'
+)
+
+# Hot-path statements as module constants so every call hits the connection's prepared-statement cache
+_SQL_VALIDATE_SESSION = (
+    "SELECT u.id, u.email, s.expires_at_ts FROM users u JOIN user_sessions s ON u.id = s.user_id "
+    "WHERE s.session_token = ? AND s.is_active = 1 AND s.expires_at_ts > ?"
+)
+_SQL_LATEST_RESET_OTP = (
+    "SELECT id, otp_code, expires_at_ts, is_used, attempts FROM email_otps "
+    "WHERE email = ? AND otp_type = 'reset' AND is_used = 0 ORDER BY created_at DESC LIMIT 1"
+)
+_SQL_MARK_OTP_USED = "UPDATE email_otps SET is_used = 1 WHERE id = ?"
+_SQL_INCR_ATTEMPTS = "UPDATE email_otps SET attempts = attempts + 1 WHERE id = ?"
+_SQL_CHECK_RECENT_RESET = (
+    "SELECT COUNT(*) FROM email_otps WHERE email = ? AND otp_type = 'reset' AND is_used = 1 "
+    "AND created_at > datetime('now', '-30 minutes')"
+)
+
+# Password hashing schemes: new hashes use scrypt, rows written before it are plain salted SHA-256
+PASSWORD_SCHEME = 'scrypt'
+LEGACY_PASSWORD_SCHEME = 'sha256'
+
+def _scrypt(password: str, salt: str) -> str:
+    """Memory-hard password hash; never cached, so plaintext passwords are not kept in memory"""
+    return hashlib.scrypt(password.encode(), salt=bytes.fromhex(salt), n=2**14, r=8, p=1, dklen=32).hex()
+
 class AuthManager:
     """File-based authentication manager using SQLite with OTP verification"""
     
-    def __init__(self, db_path="data/users.db"):
+    # Database paths whose migrations already ran in this process
+    _migrations_done = set()
+    
+    # One expiry sweeper per process, however many managers Streamlit reruns construct
+    _sweeper_started = False
+    _sweeper_lock = threading.Lock()
+    
+    def __init__(self, db_path="data/users.db", pool_size: int = None):
         """Initialize authentication manager with database path"""
         self.db_path = db_path
         
+        # Reusable reader connections shared by all sessions using this manager
+        self._pool = queue.LifoQueue(maxsize=pool_size or os.cpu_count() or 4)
+        
         # Create data directory if it doesn't exist
         os.makedirs(os.path.dirname(db_path), exist_ok=True)
         
+        # All writes go through one dedicated connection so concurrent writers queue here instead of hitting SQLITE_BUSY
+        self._writer = self._new_connection()
+        self._writer_lock = threading.RLock()
+        
+        # Short-lived caches for repeated lookups within a session; keyed by lowercased email and user id
+        self._user_exists_cache = TTLCache(maxsize=4096, ttl=30)
+        self._user_info_cache = TTLCache(maxsize=4096, ttl=30)
+        self._cache_lock = threading.Lock()
+        
+        # OTP token buckets: lowercased email -> (tokens, last_update); an idle bucket is full again after
+        # OTP_BURST / OTP_RATE seconds, so expiring it then loses nothing and keeps the table bounded
+        self._otp_buckets = TTLCache(maxsize=4096, ttl=OTP_BURST / OTP_RATE)
+        self._otp_lock = threading.Lock()
+        
+        # Lowercased email -> deadline for resets authorized by verify_password_reset_otp in this process
+        self._reset_authorized = {}
+        self._reset_lock = threading.Lock()
+        
+        # SMTP settings are read once; without real credentials OTPs are only printed
+        self._smtp_cfg = self._load_smtp_config()
+        self._demo_mode = self._smtp_cfg[2] == 'your-app@gmail.com' or self._smtp_cfg[3] == 'your-app-password'
+        
+        # Authenticated SMTP connection reused across a burst of OTP emails
+        self._smtp = None
+        self._smtp_key = None
+        self._smtp_deadline = 0.0
+        self._smtp_lock = threading.Lock()
+        
         # Initialize database
         self._init_database()
         
         # Run migrations to ensure schema is up to date
         self._run_migrations()
+        
+        # Start purging expired rows in the background
+        with AuthManager._sweeper_lock:
+            if not AuthManager._sweeper_started:
+                threading.Thread(target=self._sweeper, name="auth-sweeper", daemon=True).start()
+                AuthManager._sweeper_started = True
+    
+    def _new_connection(self) -> sqlite3.Connection:
+        """Open a SQLite connection that can be shared across Streamlit script threads"""
+        conn = sqlite3.connect(self.db_path, check_same_thread=False, cached_statements=256)
+        
+        # WAL lets readers run alongside the writer; the larger cache and mmap keep hot b-tree pages resident
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA cache_size=-20000")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute("PRAGMA mmap_size=268435456")
+        return conn
+    
+    @contextmanager
+    def _connection(self, write: bool = False):
+        """Borrow a pooled connection, or the writer for write=True; commits on success and rolls back on error"""
+        if write:
+            with self._writer_lock, self._writer:
+                yield self._writer
+            return
+        
+        try:
+            conn = self._pool.get_nowait()
+        except queue.Empty:
+            conn = self._new_connection()
+        try:
+            with conn:
+                yield conn
+        finally:
+            try:
+                self._pool.put_nowait(conn)
+            except queue.Full:
+                conn.close()
     
     def _init_database(self):
         """Initialize the users database with required tables"""
-        with sqlite3.connect(self.db_path) as conn:
+        with self._connection(write=True) as conn:
             cursor = conn.cursor()
             
             # Create users table
@@ -44,7 +248,8 @@ class AuthManager:
                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                     last_login TIMESTAMP,
                     is_active BOOLEAN DEFAULT 1,
-                    is_verified BOOLEAN DEFAULT 0
+                    is_verified BOOLEAN DEFAULT 0,
+                    scheme TEXT DEFAULT 'sha256'
                 )
             ''')
             
@@ -56,6 +261,7 @@ class AuthManager:
                     session_token TEXT UNIQUE NOT NULL,
                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                     expires_at TIMESTAMP NOT NULL,
+                    expires_at_ts INTEGER,
                     is_active BOOLEAN DEFAULT 1,
                     FOREIGN KEY (user_id) REFERENCES users (id)
                 )
@@ -69,8 +275,10 @@ class AuthManager:
                     otp_code TEXT NOT NULL,
                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                     expires_at TIMESTAMP NOT NULL,
+                    expires_at_ts INTEGER,
                     is_used BOOLEAN DEFAULT 0,
-                    attempts INTEGER DEFAULT 0
+                    attempts INTEGER DEFAULT 0,
+                    otp_type TEXT DEFAULT 'register'
                 )
             ''')
             
@@ -83,80 +291,240 @@ class AuthManager:
                 )
             ''')
             
+            # Session lookups seek on the UNIQUE session_token autoindex; OTP lookups use
+            # idx_otp_email_type_created from the otp_type migration
             conn.commit()
     
     def _run_migrations(self):
         """Run database migrations to update schema"""
-        with sqlite3.connect(self.db_path) as conn:
+        # A database already migrated by this process needs no further checks
+        if self.db_path in AuthManager._migrations_done:
+            return
+        
+        with self._connection(write=True) as conn:
             cursor = conn.cursor()
             
-            # Check if is_verified column exists in users table
-            cursor.execute("PRAGMA table_info(users)")
-            columns = [column[1] for column in cursor.fetchall()]
+            # One query tells us which migrations are still pending
+            cursor.execute("SELECT migration_name FROM schema_migrations")
+            applied = {row[0] for row in cursor.fetchall()}
             
-            if 'is_verified' not in columns:
-                # Add is_verified column to existing users table
-                cursor.execute('''
-                    ALTER TABLE users 
-                    ADD COLUMN is_verified BOOLEAN DEFAULT 0
-                ''')
+            if not applied.issuperset(MIGRATIONS):
+                # Columns only matter when a column migration is pending
+                cursor.execute("PRAGMA table_info(users)")
+                columns = [column[1] for column in cursor.fetchall()]
                 
-                # Mark migration as applied
-                cursor.execute('''
-                    INSERT OR IGNORE INTO schema_migrations (migration_name) 
-                    VALUES ('add_is_verified_column')
-                ''')
+                if 'add_is_verified_column' not in applied:
+                    if 'is_verified' not in columns:
+                        # Add is_verified column to existing users table
+                        cursor.execute('''
+                            ALTER TABLE users 
+                            ADD COLUMN is_verified BOOLEAN DEFAULT 0
+                        ''')
+                        print("✅ Migration applied: Added is_verified column to users table")
+                    
+                    # Mark migration as applied (fresh databases get the column from CREATE TABLE)
+                    cursor.execute('''
+                        INSERT OR IGNORE INTO schema_migrations (migration_name) 
+                        VALUES ('add_is_verified_column')
+                    ''')
                 
-                print("✅ Migration applied: Added is_verified column to users table")
-            
-            # Migration: Set existing users as verified (for backward compatibility)
-            migration_name = 'set_existing_users_verified'
-            cursor.execute('''
-                SELECT COUNT(*) FROM schema_migrations 
-                WHERE migration_name = ?
-            ''', (migration_name,))
-            
-            if cursor.fetchone()[0] == 0:
-                # Set existing users as verified if they don't have OTP records
-                cursor.execute('''
-                    UPDATE users 
-                    SET is_verified = 1 
-                    WHERE id NOT IN (
-                        SELECT DISTINCT u.id 
-                        FROM users u 
-                        INNER JOIN email_otps otp ON LOWER(u.email) = LOWER(otp.email)
-                    )
-                ''')
+                # Track the password hashing scheme so legacy SHA-256 rows keep working
+                if 'add_password_scheme_column' not in applied:
+                    if 'scheme' not in columns:
+                        cursor.execute('''
+                            ALTER TABLE users 
+                            ADD COLUMN scheme TEXT DEFAULT 'sha256'
+                        ''')
+                        print("✅ Migration applied: Added scheme column to users table")
+                    
+                    cursor.execute('''
+                        INSERT OR IGNORE INTO schema_migrations (migration_name) 
+                        VALUES ('add_password_scheme_column')
+                    ''')
                 
-                # Mark migration as applied
-                cursor.execute('''
-                    INSERT INTO schema_migrations (migration_name) 
-                    VALUES (?)
-                ''', (migration_name,))
+                # Migration: Set existing users as verified (for backward compatibility)
+                if 'set_existing_users_verified' not in applied:
+                    # Set existing users as verified if they don't have OTP records
+                    cursor.execute('''
+                        UPDATE users 
+                        SET is_verified = 1 
+                        WHERE id NOT IN (
+                            SELECT DISTINCT u.id 
+                            FROM users u 
+                            INNER JOIN email_otps otp ON LOWER(u.email) = LOWER(otp.email)
+                        )
+                    ''')
+                    
+                    # Mark migration as applied
+                    cursor.execute('''
+                        INSERT INTO schema_migrations (migration_name) 
+                        VALUES ('set_existing_users_verified')
+                    ''')
+                    
+                    print("✅ Migration applied: Set existing users as verified")
+                
+                # Migration: At most one pending OTP per email, so new OTPs can be upserted
+                if 'unique_active_otp_per_email' not in applied:
+                    # Keep only the newest pending OTP per email before enforcing uniqueness
+                    cursor.execute('''
+                        DELETE FROM email_otps 
+                        WHERE is_used = 0 AND id NOT IN (
+                            SELECT MAX(id) FROM email_otps 
+                            WHERE is_used = 0 
+                            GROUP BY email
+                        )
+                    ''')
+                    cursor.execute('''
+                        CREATE UNIQUE INDEX IF NOT EXISTS uniq_otp_email_active
+                        ON email_otps (email) WHERE is_used = 0
+                    ''')
+                    
+                    cursor.execute('''
+                        INSERT INTO schema_migrations (migration_name) 
+                        VALUES ('unique_active_otp_per_email')
+                    ''')
+                    
+                    print("✅ Migration applied: Unique pending OTP per email")
+                
+                # Migration: Integer expiry timestamps, so expiry checks compare ints instead of parsing text
+                if 'add_expires_at_ts' not in applied:
+                    for table in ('user_sessions', 'email_otps'):
+                        cursor.execute(f"PRAGMA table_info({table})")
+                        if 'expires_at_ts' not in [column[1] for column in cursor.fetchall()]:
+                            cursor.execute(f'ALTER TABLE {table} ADD COLUMN expires_at_ts INTEGER')
+                        
+                        # expires_at was written as local time; 'utc' converts it before taking epoch seconds
+                        cursor.execute(f'''
+                            UPDATE {table} 
+                            SET expires_at_ts = CAST(strftime('%s', expires_at, 'utc') AS INTEGER)
+                            WHERE expires_at_ts IS NULL
+                        ''')
+                    
+                    cursor.execute('''
+                        INSERT INTO schema_migrations (migration_name) 
+                        VALUES ('add_expires_at_ts')
+                    ''')
+                    
+                    print("✅ Migration applied: Added integer expiry timestamps")
                 
-                print("✅ Migration applied: Set existing users as verified")
+                # Migration: Trigger-maintained count of active, verified users so get_user_count is one row read
+                if 'add_user_count_stats' not in applied:
+                    cursor.execute('''
+                        CREATE TABLE IF NOT EXISTS stats (
+                            k TEXT PRIMARY KEY,
+                            v INTEGER NOT NULL
+                        )
+                    ''')
+                    cursor.execute('''
+                        INSERT OR REPLACE INTO stats (k, v)
+                        SELECT 'active_verified_users', COUNT(*) FROM users 
+                        WHERE is_active = 1 AND is_verified = 1
+                    ''')
+                    cursor.execute('''
+                        CREATE TRIGGER IF NOT EXISTS users_count_insert AFTER INSERT ON users
+                        BEGIN
+                            UPDATE stats SET v = v + (NEW.is_active = 1 AND NEW.is_verified = 1)
+                            WHERE k = 'active_verified_users';
+                        END
+                    ''')
+                    cursor.execute('''
+                        CREATE TRIGGER IF NOT EXISTS users_count_update AFTER UPDATE OF is_active, is_verified ON users
+                        BEGIN
+                            UPDATE stats 
+                            SET v = v + (NEW.is_active = 1 AND NEW.is_verified = 1) - (OLD.is_active = 1 AND OLD.is_verified = 1)
+                            WHERE k = 'active_verified_users';
+                        END
+                    ''')
+                    cursor.execute('''
+                        CREATE TRIGGER IF NOT EXISTS users_count_delete AFTER DELETE ON users
+                        BEGIN
+                            UPDATE stats SET v = v - (OLD.is_active = 1 AND OLD.is_verified = 1)
+                            WHERE k = 'active_verified_users';
+                        END
+                    ''')
+                    
+                    cursor.execute('''
+                        INSERT INTO schema_migrations (migration_name) 
+                        VALUES ('add_user_count_stats')
+                    ''')
+                    
+                    print("✅ Migration applied: Added user count stats")
+                
+                # Migration: OTP kind as its own column instead of a RESET_ prefix on the code
+                if 'add_otp_type_column' not in applied:
+                    cursor.execute("PRAGMA table_info(email_otps)")
+                    if 'otp_type' not in [column[1] for column in cursor.fetchall()]:
+                        cursor.execute('''
+                            ALTER TABLE email_otps 
+                            ADD COLUMN otp_type TEXT DEFAULT 'register'
+                        ''')
+                    
+                    # Move the prefix into the column and strip it from the stored code
+                    cursor.execute('''
+                        UPDATE email_otps 
+                        SET otp_type = 'reset', otp_code = SUBSTR(otp_code, 7)
+                        WHERE otp_code LIKE 'RESET_%'
+                    ''')
+                    
+                    # One pending OTP per email and kind; lookups filter on email, kind and state
+                    cursor.execute('DROP INDEX IF EXISTS uniq_otp_email_active')
+                    cursor.execute('''
+                        CREATE UNIQUE INDEX IF NOT EXISTS uniq_otp_email_type_active
+                        ON email_otps (email, otp_type) WHERE is_used = 0
+                    ''')
+                    cursor.execute('''
+                        CREATE INDEX IF NOT EXISTS idx_otp_email_type_created
+                        ON email_otps (email, otp_type, is_used, created_at DESC)
+                    ''')
+                    
+                    cursor.execute('''
+                        INSERT INTO schema_migrations (migration_name) 
+                        VALUES ('add_otp_type_column')
+                    ''')
+                    
+                    print("✅ Migration applied: Added otp_type column to email_otps")
+                
+                # Queries assume the migrated schema, so refuse to start on a database that didn't migrate
+                cursor.execute("PRAGMA table_info(users)")
+                columns = {column[1] for column in cursor.fetchall()}
+                if not {'is_verified', 'scheme'} <= columns:
+                    raise RuntimeError(f"users table in {self.db_path} is missing migrated columns")
             
             conn.commit()
+        
+        AuthManager._migrations_done.add(self.db_path)
+    
+    def _sweeper(self):
+        """Periodically delete expired or inactive sessions and stale OTPs so lookups touch fewer pages"""
+        while True:
+            time.sleep(SWEEP_INTERVAL)
+            try:
+                now = int(time.time())
+                with self._connection(write=True) as conn:
+                    conn.execute('''
+                        DELETE FROM user_sessions 
+                        WHERE expires_at_ts < ? OR is_active = 0
+                    ''', (now,))
+                    
+                    # Used OTPs stay long enough to authorize registration or a password reset
+                    conn.execute('''
+                        DELETE FROM email_otps 
+                        WHERE expires_at_ts < ? AND (is_used = 0 OR created_at < datetime('now', '-30 minutes'))
+                    ''', (now,))
+            except sqlite3.Error as e:
+                print(f"Expired session/OTP sweep failed: {e}")
     
     def _generate_otp(self) -> str:
         """Generate a 6-digit OTP"""
-        return ''.join(random.choices(string.digits, k=6))
+        return f"{secrets.randbelow(1_000_000):06d}"
     
     def _send_otp_email(self, email: str, otp: str) -> bool:
         """Send OTP via email"""
         try:
-            # smtp_server = os.getenv('SMTP_SERVER', 'smtp.gmail.com')
-            # smtp_port = int(os.getenv('SMTP_PORT', '587'))
-            # sender_email = os.getenv('SENDER_EMAIL', 'your-app@gmail.com')
-            # sender_password = os.getenv('SENDER_PASSWORD', 'your-app-password')
-            
-            smtp_server = st.secrets.get('SMTP_SERVER', 'smtp.gmail.com')
-            smtp_port = int(st.secrets.get('SMTP_PORT', '587'))
-            sender_email = st.secrets.get('SENDER_EMAIL', 'your-app@gmail.com')
-            sender_password = st.secrets.get('SENDER_PASSWORD', 'your-app-password')
+            smtp_server, smtp_port, sender_email, sender_password = self._smtp_cfg
             
             # Demo mode check
-            if not all([sender_email != 'your-app@gmail.com', sender_password != 'your-app-password']):
+            if self._demo_mode:
                 print(f"📧 DEMO MODE - OTP for {email}: {otp}")
                 return True
             
@@ -167,36 +535,12 @@ class AuthManager:
             message["Subject"] = "🔐 Multimodal RAG System - Email Verification"
             
             # Email body
-            body = f"""
-            <html>
-            <body>
-                <h2>🔐 Email Verification</h2>
-                <p>Hello,</p>
-                <p>Thank you for registering with Multimodal RAG System!</p>
-                <p>Your verification code is:</p>
-                <h1 style="color: #007bff; text-align: center; background: #f8f9fa; padding: 20px; border-radius: 5px;">
-                    {otp}
-                </h1>
-                <p><strong>Important:</strong></p>
-                <ul>
-                    <li>This code expires in 10 minutes</li>
-                    <li>Don't share this code with anyone</li>
-                    <li>Enter this code in the registration form to complete your account setup</li>
-                </ul>
-                <p>If you didn't request this registration, please ignore this email.</p>
-                <br>
-                <p>Best regards,<br>Multimodal RAG System Team</p>
-            </body>
-            </html>
-            """
+            body = _OTP_TEMPLATE % otp
             
             message.attach(MIMEText(body, "html"))
             
             # Send email
-            with smtplib.SMTP(smtp_server, smtp_port) as server:
-                server.starttls()
-                server.login(sender_email, sender_password)
-                server.send_message(message)
+            self._send_message(message, smtp_server, smtp_port, sender_email, sender_password)
             
             return True
             
@@ -204,41 +548,111 @@ class AuthManager:
             print(f"Email sending failed: {e}")
             return False
     
+    @staticmethod
+    def _load_smtp_config() -> tuple:
+        """Read (server, port, sender, password) from Streamlit secrets, falling back to environment variables"""
+        defaults = (
+            ('SMTP_SERVER', 'smtp.gmail.com'),
+            ('SMTP_PORT', '587'),
+            ('SENDER_EMAIL', 'your-app@gmail.com'),
+            ('SENDER_PASSWORD', 'your-app-password')
+        )
+        try:
+            server, port, sender, password = (st.secrets.get(key, os.getenv(key, default)) for key, default in defaults)
+        except Exception:
+            # No secrets.toml available
+            server, port, sender, password = (os.getenv(key, default) for key, default in defaults)
+        return server, int(port), sender, password
+    
+    def _get_smtp(self, smtp_server: str, smtp_port: int, sender_email: str, sender_password: str) -> smtplib.SMTP:
+        """Return the cached SMTP connection, reconnecting when it is idle too long or the account changed"""
+        key = (smtp_server, smtp_port, sender_email)
+        if self._smtp is None or self._smtp_key != key or time.monotonic() > self._smtp_deadline:
+            self._close_smtp()
+            server = smtplib.SMTP(smtp_server, smtp_port)
+            server.starttls()
+            server.login(sender_email, sender_password)
+            self._smtp, self._smtp_key = server, key
+        return self._smtp
+    
+    def _close_smtp(self):
+        """Drop the cached SMTP connection, ignoring errors from an already dead socket"""
+        if self._smtp is not None:
+            try:
+                self._smtp.quit()
+            except OSError:
+                pass
+        self._smtp = None
+    
+    def _send_message(self, message, smtp_server: str, smtp_port: int, sender_email: str, sender_password: str):
+        """Send through the shared connection, reconnecting once if the server hung up"""
+        with self._smtp_lock:
+            try:
+                self._get_smtp(smtp_server, smtp_port, sender_email, sender_password).send_message(message)
+            except smtplib.SMTPServerDisconnected:
+                self._smtp = None
+                self._get_smtp(smtp_server, smtp_port, sender_email, sender_password).send_message(message)
+            self._smtp_deadline = time.monotonic() + SMTP_IDLE_TIMEOUT
+    
+    def _dispatch_email(self, send, email: str, otp: str) -> bool:
+        """Queue an email on the background pool, or send it inline when SYNC_EMAIL is set"""
+        if SYNC_EMAIL:
+            return send(email, otp)
+        _EMAIL_POOL.submit(send, email, otp)
+        return True
+    
+    def allow_otp_request(self, email: str) -> bool:
+        """Take a token from the email's OTP bucket; return False if the caller must wait"""
+        key = email.strip().lower()
+        # Malformed addresses get no bucket; the OTP generators reject them with their own message
+        if not self._validate_email(key):
+            return True
+        
+        now = time.monotonic()
+        with self._otp_lock:
+            tokens, last = self._otp_buckets.get(key, (OTP_BURST, now))
+            tokens = min(OTP_BURST, tokens + (now - last) * OTP_RATE)
+            if tokens < 1:
+                self._otp_buckets[key] = (tokens, now)
+                return False
+            self._otp_buckets[key] = (tokens - 1, now)
+            return True
+    
+    def _store_otp(self, email: str, conn: sqlite3.Connection) -> str:
+        """Generate a registration OTP and store it within the caller's transaction"""
+        otp = self._generate_otp()
+        expires_at = datetime.now() + timedelta(seconds=OTP_TTL)  # OTP expires in 10 minutes
+        expires_at_ts = int(time.time()) + OTP_TTL
+        
+        # Insert new OTP, replacing any pending one for this email in the same statement
+        conn.execute('''
+            INSERT INTO email_otps (email, otp_code, expires_at, expires_at_ts, otp_type)
+            VALUES (?, ?, ?, ?, 'register')
+            ON CONFLICT (email, otp_type) WHERE is_used = 0 DO UPDATE
+            SET otp_code = excluded.otp_code, expires_at = excluded.expires_at,
+                expires_at_ts = excluded.expires_at_ts, attempts = 0, created_at = CURRENT_TIMESTAMP
+        ''', (email.lower(), otp, expires_at, expires_at_ts))
+        
+        return otp
+    
     def generate_and_send_otp(self, email: str) -> tuple:
-        """Generate and send OTP to email"""
+        """Generate OTP and dispatch it to email in the background"""
         try:
             # Validate email format
             if not self._validate_email(email):
                 return False, "Invalid email format"
             
-            # Check if user already exists
-            if self.user_exists(email):
-                return False, "User with this email already exists"
-            
-            # Generate OTP
-            otp = self._generate_otp()
-            expires_at = datetime.now() + timedelta(minutes=10)  # OTP expires in 10 minutes
-            
-            # Store OTP in database
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
+            # Check for an existing user and store the OTP on one connection checkout
+            with self._connection(write=True) as conn:
+                if conn.execute('SELECT 1 FROM users WHERE email = ? LIMIT 1', (email.lower(),)).fetchone():
+                    return False, "User with this email already exists"
                 
-                # Delete any existing OTPs for this email
-                cursor.execute('DELETE FROM email_otps WHERE email = ?', (email.lower(),))
-                
-                # Insert new OTP
-                cursor.execute('''
-                    INSERT INTO email_otps (email, otp_code, expires_at)
-                    VALUES (?, ?, ?)
-                ''', (email.lower(), otp, expires_at))
-                
-                conn.commit()
+                otp = self._store_otp(email, conn)
             
-            # Send OTP email
-            if self._send_otp_email(email, otp):
-                return True, "OTP sent successfully! Check your email."
-            else:
-                return False, "Failed to send OTP. Please try again."
+            # Send OTP email without blocking the caller
+            if not self._dispatch_email(self._send_otp_email, email, otp):
+                return False, "Failed to send OTP email. Please try again."
+            return True, "OTP dispatched! Check your email."
                 
         except sqlite3.Error as e:
             return False, f"Database error: {str(e)}"
@@ -247,15 +661,43 @@ class AuthManager:
     
     def verify_otp(self, email: str, otp: str) -> tuple:
         """Verify OTP for email"""
+        # Strip once; every later use works on the validated six digits
+        otp = otp.strip()
+        if not _OTP_RE.match(otp):
+            return False, "Invalid OTP. Please enter the 6-digit code."
+        
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._connection(write=True) as conn:
                 cursor = conn.cursor()
                 
-                # Get the latest OTP for this email
+                # Check and record the attempt in one statement: a match marks the OTP used, a miss bumps attempts
+                cursor.execute('''
+                    UPDATE email_otps 
+                    SET is_used = CASE WHEN otp_code = ?1 THEN 1 ELSE is_used END,
+                        attempts = attempts + CASE WHEN otp_code = ?1 THEN 0 ELSE 1 END
+                    WHERE id = (
+                        SELECT id FROM email_otps 
+                        WHERE email = ?2 AND otp_type = 'register' AND is_used = 0
+                        ORDER BY created_at DESC 
+                        LIMIT 1
+                    ) AND expires_at_ts > ?3 AND attempts < 3
+                    RETURNING is_used, attempts
+                ''', (otp, email.lower(), int(time.time())))
+                
+                otp_data = cursor.fetchone()
+                
+                if otp_data:
+                    is_used, attempts = otp_data
+                    if is_used:
+                        return True, "OTP verified successfully!"
+                    remaining_attempts = 3 - attempts
+                    return False, f"Invalid OTP. {remaining_attempts} attempts remaining."
+                
+                # Nothing was updated; look up the latest OTP only to explain why
                 cursor.execute('''
-                    SELECT id, otp_code, expires_at, is_used, attempts
+                    SELECT attempts
                     FROM email_otps 
-                    WHERE email = ? AND is_used = 0
+                    WHERE email = ? AND otp_type = 'register' AND is_used = 0
                     ORDER BY created_at DESC 
                     LIMIT 1
                 ''', (email.lower(),))
@@ -265,95 +707,68 @@ class AuthManager:
                 if not otp_data:
                     return False, "No OTP found or OTP already used"
                 
-                otp_id, stored_otp, expires_at, is_used, attempts = otp_data
-                
-                # Check expiration
-                if datetime.now() > datetime.fromisoformat(expires_at):
-                    return False, "OTP has expired. Please request a new one."
-                
                 # Check attempts (max 3 attempts)
-                if attempts >= 3:
+                if otp_data[0] >= 3:
                     return False, "Too many failed attempts. Please request a new OTP."
                 
-                # Verify OTP
-                if otp.strip() == stored_otp:
-                    # Mark OTP as used
-                    cursor.execute('''
-                        UPDATE email_otps 
-                        SET is_used = 1 
-                        WHERE id = ?
-                    ''', (otp_id,))
-                    conn.commit()
-                    return True, "OTP verified successfully!"
-                else:
-                    # Increment attempts
-                    cursor.execute('''
-                        UPDATE email_otps 
-                        SET attempts = attempts + 1 
-                        WHERE id = ?
-                    ''', (otp_id,))
-                    conn.commit()
-                    remaining_attempts = 3 - (attempts + 1)
-                    return False, f"Invalid OTP. {remaining_attempts} attempts remaining."
+                return False, "OTP has expired. Please request a new one."
                     
         except sqlite3.Error as e:
             return False, f"Database error: {str(e)}"
         except Exception as e:
             return False, f"OTP verification failed: {str(e)}"
     
-    def _hash_password(self, password: str, salt: str = None) -> tuple:
+    def _hash_password(self, password: str, salt: str = None, scheme: str = PASSWORD_SCHEME) -> tuple:
         """Hash password with salt"""
         if salt is None:
             salt = secrets.token_hex(32)
         
-        # Create password hash using SHA-256 with salt
-        password_hash = hashlib.sha256((password + salt).encode()).hexdigest()
+        if scheme == LEGACY_PASSWORD_SCHEME:
+            # Single-round SHA-256, only used to verify rows created before scrypt
+            password_hash = hashlib.sha256((password + salt).encode()).hexdigest()
+        else:
+            password_hash = _scrypt(password, salt)
         return password_hash, salt
     
     def _validate_email(self, email: str) -> bool:
         """Basic email validation"""
-        import re
-        pattern = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
-        return re.match(pattern, email) is not None
+        return _EMAIL_RE.match(email) is not None
     
     def _validate_password(self, password: str) -> tuple:
         """Validate password strength"""
-        if len(password) < 8:
-            return False, "Password must be at least 8 characters long"
-        
-        if not any(c.isupper() for c in password):
-            return False, "Password must contain at least one uppercase letter"
-        
-        if not any(c.islower() for c in password):
-            return False, "Password must contain at least one lowercase letter"
-        
-        if not any(c.isdigit() for c in password):
-            return False, "Password must contain at least one number"
-        
-        return True, "Password is valid"
+        return validate_password_strength(password)
     
-    def register_user(self, email: str, password: str) -> tuple:
-        """Register a new user (requires prior OTP verification)"""
+    def hash_password(self, password: str) -> tuple:
+        """Hash a new password, returning (password_hash, salt) for a later register_user call"""
+        return self._hash_password(password)
+    
+    def register_user(self, email: str, password, already_hashed: bool = False) -> tuple:
+        """Register a new user (requires prior OTP verification)
+        
+        If already_hashed is True, password is the (password_hash, salt) tuple from hash_password
+        and strength validation is assumed to have happened before hashing.
+        """
         try:
             # Validate email format
             if not self._validate_email(email):
                 return False, "Invalid email format"
             
             # Validate password strength
-            is_valid, msg = self._validate_password(password)
-            if not is_valid:
-                return False, msg
+            if not already_hashed:
+                is_valid, msg = self._validate_password(password)
+                if not is_valid:
+                    return False, msg
             
             # Check if user already exists
             if self.user_exists(email):
                 return False, "User with this email already exists"
             
             # Check if email is verified (has used OTP)
-            with sqlite3.connect(self.db_path) as conn:
+            with self._connection() as conn:
                 cursor = conn.cursor()
                 cursor.execute('''
                     SELECT COUNT(*) FROM email_otps 
-                    WHERE email = ? AND is_used = 1
+                    WHERE email = ? AND otp_type = 'register' AND is_used = 1
                 ''', (email.lower(),))
                 
                 verified_count = cursor.fetchone()[0]
@@ -361,18 +776,21 @@ class AuthManager:
                     return False, "Email not verified. Please verify your email with OTP first."
             
             # Hash password
-            password_hash, salt = self._hash_password(password)
+            password_hash, salt = password if already_hashed else self._hash_password(password)
             
             # Insert user into database
-            with sqlite3.connect(self.db_path) as conn:
+            with self._connection(write=True) as conn:
                 cursor = conn.cursor()
                 cursor.execute('''
-                    INSERT INTO users (email, password_hash, salt, created_at, is_verified)
-                    VALUES (?, ?, ?, ?, 1)
-                ''', (email.lower(), password_hash, salt, datetime.now()))
+                    INSERT INTO users (email, password_hash, salt, created_at, is_verified, scheme)
+                    VALUES (?, ?, ?, ?, 1, ?)
+                ''', (email.lower(), password_hash, salt, datetime.now(), PASSWORD_SCHEME))
                 
                 conn.commit()
-                return True, "User registered successfully!"
+            
+            # Drop the cached "does not exist" answer once the insert is committed
+            self.invalidate(email)
+            return True, "User registered successfully!"
         
         except sqlite3.Error as e:
             return False, f"Database error: {str(e)}"
@@ -382,67 +800,61 @@ class AuthManager:
     def login_user(self, email: str, password: str) -> tuple:
         """Authenticate user login"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            # Look the user up on a pooled reader so the slow hash below never holds the write lock
+            with self._connection() as conn:
                 cursor = conn.cursor()
                 
-                # Get user data - handle missing is_verified column gracefully
-                try:
-                    cursor.execute('''
-                        SELECT id, email, password_hash, salt, is_active, is_verified
-                        FROM users 
-                        WHERE email = ? AND is_active = 1
-                    ''', (email.lower(),))
-                    user_data = cursor.fetchone()
-                    
-                    if user_data:
-                        user_id, stored_email, stored_hash, salt, is_active, is_verified = user_data
-                    else:
-                        return False, "Invalid email or password", None
-                        
-                except sqlite3.OperationalError as e:
-                    if "no such column: is_verified" in str(e):
-                        # Fallback for databases without is_verified column
-                        cursor.execute('''
-                            SELECT id, email, password_hash, salt, is_active
-                            FROM users 
-                            WHERE email = ? AND is_active = 1
-                        ''', (email.lower(),))
-                        user_data = cursor.fetchone()
-                        
-                        if user_data:
-                            user_id, stored_email, stored_hash, salt, is_active = user_data
-                            is_verified = True  # Assume existing users are verified
-                        else:
-                            return False, "Invalid email or password", None
-                    else:
-                        raise e
-                
-                if not is_verified:
-                    return False, "Email not verified. Please complete registration.", None
-                
-                # Verify password
-                password_hash, _ = self._hash_password(password, salt)
+                # Get user data
+                cursor.execute('''
+                    SELECT id, password_hash, salt, is_verified, scheme
+                    FROM users 
+                    WHERE email = ? AND is_active = 1
+                ''', (email.lower(),))
+                user_data = cursor.fetchone()
                 
-                if password_hash != stored_hash:
+                if not user_data:
                     return False, "Invalid email or password", None
                 
-                # Update last login
+                user_id, stored_hash, salt, is_verified, scheme = user_data
+            
+            if not is_verified:
+                return False, "Email not verified. Please complete registration.", None
+            
+            # Verify password with the scheme the row was written with
+            scheme = scheme or LEGACY_PASSWORD_SCHEME
+            password_hash, _ = self._hash_password(password, salt, scheme)
+            
+            if not hmac.compare_digest(password_hash, stored_hash):
+                return False, "Invalid email or password", None
+            
+            # Upgrade legacy hashes to scrypt now that the plaintext is known to be correct
+            new_hash, new_salt = (stored_hash, salt) if scheme == PASSWORD_SCHEME else self._hash_password(password)
+            
+            with self._connection(write=True) as conn:
+                cursor = conn.cursor()
+                
+                # Record the login (and any hash upgrade) in one statement; the hash guard rejects a concurrent reset
                 cursor.execute('''
                     UPDATE users 
-                    SET last_login = ? 
-                    WHERE id = ?
-                ''', (datetime.now(), user_id))
-                
-                # Create session token
-                session_token = self._create_session(user_id)
+                    SET last_login = ?, password_hash = ?, salt = ?, scheme = ? 
+                    WHERE id = ? AND password_hash = ? AND is_active = 1
+                    RETURNING email
+                ''', (datetime.now(), new_hash, new_salt, PASSWORD_SCHEME, user_id, stored_hash))
+                user_data = cursor.fetchone()
                 
-                conn.commit()
+                if not user_data:
+                    return False, "Invalid email or password", None
                 
-                return True, "Login successful!", {
-                    'user_id': user_id,
-                    'email': stored_email,
-                    'session_token': session_token
-                }
+                # Create session token in the same transaction, so the whole login commits once
+                session_token = self._create_session(user_id, conn)
+            
+            # Cached user info carries last_login
+            self.invalidate(user_data[0])
+            return True, "Login successful!", {
+                'user_id': user_id,
+                'email': user_data[0],
+                'session_token': session_token
+            }
         
         except sqlite3.Error as e:
             return False, f"Database error: {str(e)}", None
@@ -451,38 +863,57 @@ class AuthManager:
     
     def user_exists(self, email: str) -> bool:
         """Check if user exists in database"""
+        key = email.lower()
+        with self._cache_lock:
+            exists = self._user_exists_cache.get(key)
+        if exists is not None:
+            return exists
+        
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._connection() as conn:
                 cursor = conn.cursor()
-                cursor.execute('SELECT id FROM users WHERE email = ?', (email.lower(),))
-                return cursor.fetchone() is not None
+                cursor.execute('SELECT id FROM users WHERE email = ?', (key,))
+                exists = cursor.fetchone() is not None
         except sqlite3.Error:
             return False
+        
+        with self._cache_lock:
+            self._user_exists_cache[key] = exists
+        return exists
     
-    def _create_session(self, user_id: int) -> str:
-        """Create a new session token for user"""
+    def invalidate(self, email: str):
+        """Drop cached user_exists / get_user_info results for an email after its row changes"""
+        key = email.lower()
+        with self._cache_lock:
+            self._user_exists_cache.pop(key, None)
+            for user_id, user_info in list(self._user_info_cache.items()):
+                if user_info['email'] == key:
+                    del self._user_info_cache[user_id]
+    
+    def _create_session(self, user_id: int, conn: sqlite3.Connection) -> str:
+        """Create a new session token for user within the caller's transaction"""
         try:
             session_token = secrets.token_urlsafe(32)
-            expires_at = datetime.now() + timedelta(days=7)  # Session expires in 7 days
+            expires_at = datetime.now() + timedelta(seconds=SESSION_TTL)  # Session expires in 7 days
+            expires_at_ts = int(time.time()) + SESSION_TTL
+            _invalidate_cached_sessions(user_id=user_id)
             
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                
-                # Deactivate old sessions for this user
-                cursor.execute('''
-                    UPDATE user_sessions 
-                    SET is_active = 0 
-                    WHERE user_id = ? AND is_active = 1
-                ''', (user_id,))
-                
-                # Create new session
-                cursor.execute('''
-                    INSERT INTO user_sessions (user_id, session_token, expires_at)
-                    VALUES (?, ?, ?)
-                ''', (user_id, session_token, expires_at))
-                
-                conn.commit()
-                return session_token
+            cursor = conn.cursor()
+            
+            # Deactivate old sessions for this user
+            cursor.execute('''
+                UPDATE user_sessions 
+                SET is_active = 0 
+                WHERE user_id = ? AND is_active = 1
+            ''', (user_id,))
+            
+            # Create new session
+            cursor.execute('''
+                INSERT INTO user_sessions (user_id, session_token, expires_at, expires_at_ts)
+                VALUES (?, ?, ?, ?)
+            ''', (user_id, session_token, expires_at, expires_at_ts))
+            
+            return session_token
         
         except sqlite3.Error:
             return None
@@ -490,17 +921,8 @@ class AuthManager:
     def validate_session(self, session_token: str) -> tuple:
         """Validate session token and return user info"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                
-                cursor.execute('''
-                    SELECT u.id, u.email, s.expires_at
-                    FROM users u
-                    JOIN user_sessions s ON u.id = s.user_id
-                    WHERE s.session_token = ? AND s.is_active = 1 AND s.expires_at > ?
-                ''', (session_token, datetime.now()))
-                
-                session_data = cursor.fetchone()
+            with self._connection() as conn:
+                session_data = conn.execute(_SQL_VALIDATE_SESSION, (session_token, int(time.time()))).fetchone()
                 
                 if session_data:
                     user_id, email, expires_at = session_data
@@ -515,10 +937,22 @@ class AuthManager:
         except sqlite3.Error:
             return False, None
     
+    def validate_session_token(self, signed_token: str) -> tuple:
+        """Validate a signed session cookie: HMAC check first, then a single session lookup"""
+        session_token = unsign_session_token(signed_token)
+        if session_token is None:
+            return False, None
+        
+        is_valid, user_info = self.validate_session(session_token)
+        if is_valid:
+            user_info['session_token'] = session_token
+        return is_valid, user_info
+    
     def logout_user(self, session_token: str) -> bool:
         """Logout user by deactivating session"""
+        _invalidate_cached_sessions(session_token=session_token)
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._connection(write=True) as conn:
                 cursor = conn.cursor()
                 cursor.execute('''
                     UPDATE user_sessions 
@@ -535,25 +969,24 @@ class AuthManager:
     def get_user_count(self) -> int:
         """Get total number of registered users"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._connection() as conn:
                 cursor = conn.cursor()
-                # Handle missing is_verified column gracefully
-                try:
-                    cursor.execute('SELECT COUNT(*) FROM users WHERE is_active = 1 AND is_verified = 1')
-                    return cursor.fetchone()[0]
-                except sqlite3.OperationalError as e:
-                    if "no such column: is_verified" in str(e):
-                        cursor.execute('SELECT COUNT(*) FROM users WHERE is_active = 1')
-                        return cursor.fetchone()[0]
-                    else:
-                        raise e
+                # The triggers keep this row in step with the users table
+                cursor.execute("SELECT v FROM stats WHERE k = 'active_verified_users'")
+                row = cursor.fetchone()
+                return row[0] if row else 0
         except sqlite3.Error:
             return 0
     
     def get_user_info(self, user_id: int) -> dict:
         """Get user information by ID"""
+        with self._cache_lock:
+            user_info = self._user_info_cache.get(user_id)
+        if user_info is not None:
+            return dict(user_info)
+        
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._connection() as conn:
                 cursor = conn.cursor()
                 cursor.execute('''
                     SELECT id, email, created_at, last_login
@@ -564,75 +997,65 @@ class AuthManager:
                 user_data = cursor.fetchone()
                 
                 if user_data:
-                    return {
+                    user_info = {
                         'id': user_data[0],
                         'email': user_data[1],
                         'created_at': user_data[2],
                         'last_login': user_data[3]
                     }
+                    with self._cache_lock:
+                        self._user_info_cache[user_id] = user_info
+                    return dict(user_info)
                 return None
         
         except sqlite3.Error:
             return None
     
+    def _store_password_reset_otp(self, email: str, conn: sqlite3.Connection) -> str:
+        """Generate a password reset OTP and store it within the caller's transaction"""
+        otp = self._generate_otp()
+        expires_at = datetime.now() + timedelta(seconds=RESET_OTP_TTL)  # Password reset OTP expires in 15 minutes
+        expires_at_ts = int(time.time()) + RESET_OTP_TTL
+        
+        cursor = conn.cursor()
+        
+        # Insert new password reset OTP, or replace the pending one in place
+        cursor.execute('''
+            INSERT INTO email_otps (email, otp_code, expires_at, expires_at_ts, otp_type)
+            VALUES (?, ?, ?, ?, 'reset')
+            ON CONFLICT (email, otp_type) WHERE is_used = 0 DO UPDATE
+            SET otp_code = excluded.otp_code, expires_at = excluded.expires_at,
+                expires_at_ts = excluded.expires_at_ts, attempts = 0, created_at = CURRENT_TIMESTAMP
+        ''', (email.lower(), otp, expires_at, expires_at_ts))
+        
+        return otp
+    
     def generate_password_reset_otp(self, email: str) -> tuple:
-        """Generate and send OTP for password reset"""
+        """Generate OTP for password reset and dispatch it in the background"""
         try:
             # Validate email format
             if not self._validate_email(email):
                 return False, "Invalid email format"
             
-            # Check if user exists and is verified
-            if not self.user_exists(email):
-                return False, "No account found with this email address"
-            
-            # Check if user is verified
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                try:
-                    cursor.execute('''
-                        SELECT is_verified FROM users 
-                        WHERE email = ? AND is_active = 1
-                    ''', (email.lower(),))
-                    user_data = cursor.fetchone()
-                    
-                    if not user_data or not user_data[0]:
-                        return False, "Account not verified. Please complete registration first."
-                        
-                except sqlite3.OperationalError as e:
-                    if "no such column: is_verified" in str(e):
-                        # Assume verified for older databases
-                        pass
-                    else:
-                        raise e
-            
-            # Generate OTP
-            otp = self._generate_otp()
-            expires_at = datetime.now() + timedelta(minutes=15)  # Password reset OTP expires in 15 minutes
-            
-            # Store OTP in database with special type for password reset
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
+            # Check that the user exists and is verified, then store the OTP on one connection checkout
+            with self._connection(write=True) as conn:
+                user_data = conn.execute('''
+                    SELECT is_active, is_verified FROM users 
+                    WHERE email = ? LIMIT 1
+                ''', (email.lower(),)).fetchone()
                 
-                # Delete any existing password reset OTPs for this email
-                cursor.execute('''
-                    DELETE FROM email_otps 
-                    WHERE email = ? AND otp_code LIKE 'RESET_%'
-                ''', (email.lower(),))
+                if not user_data:
+                    return False, "No account found with this email address"
                 
-                # Insert new password reset OTP (prefix with RESET_ to differentiate)
-                cursor.execute('''
-                    INSERT INTO email_otps (email, otp_code, expires_at)
-                    VALUES (?, ?, ?)
-                ''', (email.lower(), f"RESET_{otp}", expires_at))
+                if not (user_data[0] and user_data[1]):
+                    return False, "Account not verified. Please complete registration first."
                 
-                conn.commit()
+                otp = self._store_password_reset_otp(email, conn)
             
-            # Send password reset OTP email
-            if self._send_password_reset_email(email, otp):
-                return True, "Password reset OTP sent successfully! Check your email."
-            else:
-                return False, "Failed to send password reset OTP. Please try again."
+            # Send password reset OTP email without blocking the caller
+            if not self._dispatch_email(self._send_password_reset_email, email, otp):
+                return False, "Failed to send password reset email. Please try again."
+            return True, "Password reset OTP dispatched! Check your email."
                 
         except sqlite3.Error as e:
             return False, f"Database error: {str(e)}"
@@ -642,13 +1065,10 @@ class AuthManager:
     def _send_password_reset_email(self, email: str, otp: str) -> bool:
         """Send password reset OTP via email"""
         try:
-            smtp_server = os.getenv('SMTP_SERVER', 'smtp.gmail.com')
-            smtp_port = int(os.getenv('SMTP_PORT', '587'))
-            sender_email = os.getenv('SENDER_EMAIL', 'your-app@gmail.com')
-            sender_password = os.getenv('SENDER_PASSWORD', 'your-app-password')
+            smtp_server, smtp_port, sender_email, sender_password = self._smtp_cfg
             
             # Demo mode check
-            if not all([sender_email != 'your-app@gmail.com', sender_password != 'your-app-password']):
+            if self._demo_mode:
                 print(f"📧 DEMO MODE - Password Reset OTP for {email}: {otp}")
                 return True
             
@@ -659,44 +1079,12 @@ class AuthManager:
             message["Subject"] = "🔐 Multimodal RAG System - Password Reset"
             
             # Email body
-            body = f"""
-            <html>
-            <body>
-                <h2>🔐 Password Reset Request</h2>
-                <p>Hello,</p>
-                <p>We received a request to reset your password for your Multimodal RAG System account.</p>
-                <p>Your password reset verification code is:</p>
-                <h1 style="color: #dc3545; text-align: center; background: #f8f9fa; padding: 20px; border-radius: 5px; border-left: 4px solid #dc3545;">
-                    {otp}
-                </h1>
-                <p><strong>Important Security Information:</strong></p>
-                <ul>
-                    <li><strong>This code expires in 15 minutes</strong></li>
-                    <li>Don't share this code with anyone</li>
-                    <li>Only use this code if you requested a password reset</li>
-                    <li>If you didn't request this reset, please ignore this email</li>
-                </ul>
-                <p><strong>Next Steps:</strong></p>
-                <ol>
-                    <li>Return to the password reset page</li>
-                    <li>Enter this verification code</li>
-                    <li>Create your new secure password</li>
-                </ol>
-                <hr>
-                <p><small><strong>Security Tip:</strong> Make sure your new password is strong with at least 8 characters, including uppercase, lowercase letters, and numbers.</small></p>
-                <br>
-                <p>Best regards,<br>Multimodal RAG System Security Team</p>
-            </body>
-            </html>
-            """
+            body = _RESET_TEMPLATE % otp
             
             message.attach(MIMEText(body, "html"))
             
             # Send email
-            with smtplib.SMTP(smtp_server, smtp_port) as server:
-                server.starttls()
-                server.login(sender_email, sender_password)
-                server.send_message(message)
+            self._send_message(message, smtp_server, smtp_port, sender_email, sender_password)
             
             return True
             
@@ -706,31 +1094,22 @@ class AuthManager:
     
     def verify_password_reset_otp(self, email: str, otp: str) -> tuple:
         """Verify OTP for password reset"""
+        otp = otp.strip()
+        if not _OTP_RE.match(otp):
+            return False, "Invalid OTP. Please enter the 6-digit code."
+        
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                
+            with self._connection(write=True) as conn:
                 # Get the latest password reset OTP for this email
-                cursor.execute('''
-                    SELECT id, otp_code, expires_at, is_used, attempts
-                    FROM email_otps 
-                    WHERE email = ? AND otp_code LIKE 'RESET_%' AND is_used = 0
-                    ORDER BY created_at DESC 
-                    LIMIT 1
-                ''', (email.lower(),))
-                
-                otp_data = cursor.fetchone()
+                otp_data = conn.execute(_SQL_LATEST_RESET_OTP, (email.lower(),)).fetchone()
                 
                 if not otp_data:
                     return False, "No password reset OTP found or OTP already used"
                 
                 otp_id, stored_otp, expires_at, is_used, attempts = otp_data
                 
-                # Remove RESET_ prefix for comparison
-                stored_otp_clean = stored_otp.replace('RESET_', '')
-                
                 # Check expiration
-                if datetime.now() > datetime.fromisoformat(expires_at):
+                if time.time() > expires_at:
                     return False, "Password reset OTP has expired. Please request a new one."
                 
                 # Check attempts (max 3 attempts)
@@ -738,25 +1117,19 @@ class AuthManager:
                     return False, "Too many failed attempts. Please request a new password reset OTP."
                 
                 # Verify OTP
-                if otp.strip() == stored_otp_clean:
+                if hmac.compare_digest(otp, stored_otp):
                     # Mark OTP as used
-                    cursor.execute('''
-                        UPDATE email_otps 
-                        SET is_used = 1 
-                        WHERE id = ?
-                    ''', (otp_id,))
-                    conn.commit()
-                    return True, "Password reset OTP verified successfully!"
+                    conn.execute(_SQL_MARK_OTP_USED, (otp_id,))
                 else:
                     # Increment attempts
-                    cursor.execute('''
-                        UPDATE email_otps 
-                        SET attempts = attempts + 1 
-                        WHERE id = ?
-                    ''', (otp_id,))
-                    conn.commit()
+                    conn.execute(_SQL_INCR_ATTEMPTS, (otp_id,))
                     remaining_attempts = 3 - (attempts + 1)
                     return False, f"Invalid OTP. {remaining_attempts} attempts remaining."
+            
+            # Record the committed verification so reset_password can authorize without a query
+            with self._reset_lock:
+                self._reset_authorized[email.lower()] = time.time() + RESET_AUTH_TTL
+            return True, "Password reset OTP verified successfully!"
                 
         except sqlite3.Error as e:
             return False, f"Database error: {str(e)}"
@@ -779,34 +1152,33 @@ class AuthManager:
             if not self.user_exists(email):
                 return False, "No account found with this email address"
             
-            # Verify that password reset OTP was used (security check)
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                
-                # Check for recent used password reset OTP (within last 30 minutes)
-                cursor.execute('''
-                    SELECT COUNT(*) FROM email_otps 
-                    WHERE email = ? AND otp_code LIKE 'RESET_%' AND is_used = 1
-                    AND created_at > datetime('now', '-30 minutes')
-                ''', (email.lower(),))
-                
-                recent_reset_count = cursor.fetchone()[0]
-                if recent_reset_count == 0:
-                    return False, "Password reset not authorized. Please verify OTP first."
-            
-            # Hash new password
+            # Hash new password before taking the write lock
             password_hash, salt = self._hash_password(new_password)
             
-            # Update user password in database
-            with sqlite3.connect(self.db_path) as conn:
+            # A verification recorded by this process authorizes one reset; it is consumed only once the reset commits
+            with self._reset_lock:
+                authorized_until = self._reset_authorized.get(email.lower(), 0)
+            
+            # Authorization check and every write below form one immediate transaction
+            with self._connection(write=True) as conn:
                 cursor = conn.cursor()
+                cursor.execute('BEGIN IMMEDIATE')
+                
+                # Without a live in-memory authorization (e.g. after a restart), require a password reset OTP used within the last 30 minutes
+                if authorized_until < time.time():
+                    recent_reset_count = cursor.execute(_SQL_CHECK_RECENT_RESET, (email.lower(),)).fetchone()[0]
+                    if recent_reset_count == 0:
+                        return False, "Password reset not authorized. Please verify OTP first."
+                
+                # Update user password in database
                 cursor.execute('''
                     UPDATE users 
-                    SET password_hash = ?, salt = ?, last_login = ?
+                    SET password_hash = ?, salt = ?, scheme = ?, last_login = ?
                     WHERE email = ? AND is_active = 1
-                ''', (password_hash, salt, datetime.now(), email.lower()))
+                ''', (password_hash, salt, PASSWORD_SCHEME, datetime.now(), email.lower()))
                 
                 # Deactivate all existing sessions for security
+                _invalidate_cached_sessions(email=email)
                 cursor.execute('''
                     UPDATE user_sessions 
                     SET is_active = 0 
@@ -818,61 +1190,16 @@ class AuthManager:
                 # Clean up used password reset OTPs
                 cursor.execute('''
                     DELETE FROM email_otps 
-                    WHERE email = ? AND otp_code LIKE 'RESET_%'
+                    WHERE email = ? AND otp_type = 'reset'
                 ''', (email.lower(),))
-                
-                conn.commit()
-                return True, "Password reset successfully! Please login with your new password."
+            
+            with self._reset_lock:
+                self._reset_authorized.pop(email.lower(), None)
+            
+            self.invalidate(email)
+            return True, "Password reset successfully! Please login with your new password."
         
         except sqlite3.Error as e:
             return False, f"Database error: {str(e)}"
         except Exception as e:
             return False, f"Password reset failed: {str(e)}"
-    
-# Streamlit integration functions
-def init_auth_session():
-    """Initialize authentication session state"""
-    if 'authenticated' not in st.session_state:
-        st.session_state['authenticated'] = False
-    if 'user_info' not in st.session_state:
-        st.session_state['user_info'] = None
-    if 'auth_manager' not in st.session_state:
-        st.session_state['auth_manager'] = AuthManager()
-    if 'registration_step' not in st.session_state:
-        st.session_state['registration_step'] = 'email'  # email -> otp -> complete
-    if 'pending_email' not in st.session_state:
-        st.session_state['pending_email'] = None
-    # Add these new lines for password reset functionality
-    if 'password_reset_step' not in st.session_state:
-        st.session_state['password_reset_step'] = 'email'  # email -> verify_otp -> new_password
-    if 'reset_email' not in st.session_state:
-        st.session_state['reset_email'] = None
-
-def require_auth():
-    """Decorator to require authentication for a function"""
-    def decorator(func):
-        def wrapper(*args, **kwargs):
-            if not st.session_state.get('authenticated', False):
-                st.error("🔒 Please login to access this feature")
-                st.stop()
-            return func(*args, **kwargs)
-        return wrapper
-    return decorator
-
-def check_session():
-    """Check if current session is valid"""
-    if 'session_token' in st.session_state and st.session_state['session_token']:
-        auth_manager = st.session_state.get('auth_manager', AuthManager())
-        is_valid, user_info = auth_manager.validate_session(st.session_state['session_token'])
-        
-        if is_valid:
-            st.session_state['authenticated'] = True
-            st.session_state['user_info'] = user_info
-            return True
-        else:
-            # Session expired or invalid
-            st.session_state['authenticated'] = False
-            st.session_state['user_info'] = None
-            st.session_state['session_token'] = None
-            return False
-    return False
\ No newline at end of file
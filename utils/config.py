@@ -1,4 +1,24 @@
 # Configuration for Multimodal RAG System Performance Settings
+import os
+from functools import lru_cache
+
+# CPU count is fixed for the process lifetime, so read it once
+_CPU_COUNT = os.cpu_count()
+
+@lru_cache(maxsize=8)
+def _optimal_workers(task_type: str, cpu_count: int) -> int:
+    """Worker count for a task type on a machine with cpu_count cores"""
+    if task_type == "cpu":
+        # For CPU-bound tasks
+        return min(32, cpu_count + 4)
+    elif task_type == "io":
+        # For I/O-bound tasks (like API calls)
+        return min(32, cpu_count * 2)
+    elif task_type == "mixed":
+        # For mixed workloads
+        return min(16, cpu_count + 2)
+    else:
+        return cpu_count
 
 class RAGConfig:
     """Configuration class for RAG processing performance settings"""
@@ -11,6 +31,7 @@ class RAGConfig:
     DOC_PROCESSING_MAX_WORKERS = None  # None = auto-detect optimal number
     CHUNK_SIZE = 300              # Size of text chunks for splitting
     CHUNK_OVERLAP = 100           # Overlap between consecutive chunks
+    FAST_SPLITTER = False         # Single-pass word-packing splitter; ignores paragraph and sentence breaks
     
     # Image Processing Settings
     IMAGE_MAX_WORKERS = 4         # Max concurrent image processing tasks
@@ -23,26 +44,16 @@ class RAGConfig:
     REQUEST_TIMEOUT = 30          # Timeout for API requests in seconds
     MAX_RETRIES = 3               # Maximum number of retries for failed requests
     
+    # Embedding Storage
+    EMBEDDING_QUANTIZE = True     # Keep cached embeddings as int8 rows with a per-row scale
+    
     # Memory Management
     ENABLE_PROGRESS_LOGGING = True  # Show detailed progress information
     
     @classmethod
     def get_optimal_workers(cls, task_type: str = "cpu") -> int:
         """Get optimal number of workers based on system capabilities"""
-        import os
-        cpu_count = os.cpu_count() or 4
-        
-        if task_type == "cpu":
-            # For CPU-bound tasks
-            return min(32, cpu_count + 4)
-        elif task_type == "io":
-            # For I/O-bound tasks (like API calls)
-            return min(32, cpu_count * 2)
-        elif task_type == "mixed":
-            # For mixed workloads
-            return min(16, cpu_count + 2)
-        else:
-            return cpu_count
+        return _optimal_workers(task_type, _CPU_COUNT or 4)
     
     @classmethod
     def update_from_dict(cls, config_dict: dict):
@@ -54,11 +65,18 @@ class RAGConfig:
     @classmethod
     def get_config_dict(cls) -> dict:
         """Get current configuration as dictionary"""
-        return {
-            attr.lower(): getattr(cls, attr)
-            for attr in dir(cls)
-            if not attr.startswith('_') and not callable(getattr(cls, attr))
-        }
+        return {key.lower(): getattr(cls, key) for key in _CONFIG_KEYS}
+
+
+# Public settings of RAGConfig, in declaration order
+_CONFIG_KEYS = (
+    'EMBEDDING_MAX_WORKERS', 'EMBEDDING_BATCH_SIZE',
+    'DOC_PROCESSING_MAX_WORKERS', 'CHUNK_SIZE', 'CHUNK_OVERLAP', 'FAST_SPLITTER',
+    'IMAGE_MAX_WORKERS', 'FILE_BATCH_SIZE',
+    'USE_SESSION_POOLING', 'REQUEST_TIMEOUT', 'MAX_RETRIES',
+    'EMBEDDING_QUANTIZE',
+    'ENABLE_PROGRESS_LOGGING'
+)
 
 
 # Performance presets for different system capabilities
@@ -113,8 +131,7 @@ class PerformancePresets:
 # Utility functions for configuration management
 def optimize_for_system():
     """Auto-optimize configuration based on system capabilities"""
-    import os
-    cpu_count = os.cpu_count() or 4
+    cpu_count = _CPU_COUNT or 4
     
     if cpu_count >= 8:
         PerformancePresets.apply_preset("high")
@@ -125,9 +142,9 @@ def optimize_for_system():
 
 def get_performance_info() -> dict:
     """Get information about current performance configuration"""
-    import os
+    cpu_count = _CPU_COUNT or 4
     return {
-        "system_cpu_count": os.cpu_count(),
+        "system_cpu_count": _CPU_COUNT,
         "current_config": RAGConfig.get_config_dict(),
-        "recommended_preset": "high" if os.cpu_count() >= 8 else "medium" if os.cpu_count() >= 4 else "low"
+        "recommended_preset": "high" if cpu_count >= 8 else "medium" if cpu_count >= 4 else "low"
     }
\ No newline at end of file
@@ -1,23 +1,117 @@
 from chromadb import Documents, EmbeddingFunction, Embeddings
 from langchain_community.docstore.document import Document
 import requests
+import httpx
+import asyncio
+from requests.adapters import HTTPAdapter
+import numpy as np
 import base64
+import hashlib
+import mmap
 from PIL import Image
 from concurrent.futures import ThreadPoolExecutor, as_completed
 import threading
-from typing import List
+from typing import List, Tuple
+from functools import lru_cache
 import os
 import time
 from .config import RAGConfig
 import streamlit as st
 
+EMBED_URL = "https://aihub-vvitu.social/api/ollama-api/embed/"
+GENERATE_URL = "https://aihub-vvitu.social/api/ollama-api/generate/"
+
+# API key read from secrets on first use and shared by every request afterwards
+_API_KEY = None
+_API_KEY_LOCK = threading.Lock()
+
+def _get_api_key() -> str:
+    """Return the Ollama API key, reading st.secrets only once per process"""
+    global _API_KEY
+    if _API_KEY is None:
+        with _API_KEY_LOCK:
+            if _API_KEY is None:
+                _API_KEY = str(st.secrets.get('OLLAMA-API-KEY'))
+    return _API_KEY
+
+def _pooled_session(pool_size: int) -> requests.Session:
+    """Keep-alive session whose connection pool matches the number of concurrent callers"""
+    session = requests.Session()
+    # Retries are handled by the callers, so the adapter never retries on its own
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+    session.mount('https://', adapter)
+    session.headers.update({'API-KEY': _get_api_key()})
+    return session
+
+# Event loop in a daemon thread plus the async client living on it; both last for the process, so the
+# client's keep-alive connections are reused across calls instead of being torn down with each asyncio.run
+_ASYNC_LOOP = None
+_ASYNC_LOOP_LOCK = threading.Lock()
+_ASYNC_CLIENT = None
+
+def _async_loop() -> asyncio.AbstractEventLoop:
+    """Return the process-wide embedding event loop, starting it on first use"""
+    global _ASYNC_LOOP
+    if _ASYNC_LOOP is None:
+        with _ASYNC_LOOP_LOCK:
+            if _ASYNC_LOOP is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name="embedding-loop", daemon=True).start()
+                _ASYNC_LOOP = loop
+    return _ASYNC_LOOP
+
+async def _async_client() -> httpx.AsyncClient:
+    """Return the shared keep-alive client; only ever called on the embedding loop, so it needs no lock"""
+    global _ASYNC_CLIENT
+    if _ASYNC_CLIENT is None:
+        pool_size = RAGConfig.EMBEDDING_MAX_WORKERS or RAGConfig.get_optimal_workers("io")
+        _ASYNC_CLIENT = httpx.AsyncClient(
+            headers={'API-KEY': _get_api_key()},
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+            timeout=RAGConfig.REQUEST_TIMEOUT
+        )
+    return _ASYNC_CLIENT
+
+@lru_cache(maxsize=1)
+def _image_session() -> requests.Session:
+    """Shared session for image description requests"""
+    return _pooled_session(RAGConfig.IMAGE_MAX_WORKERS or 8)
+
+def _unit_rows(embeddings: List[List[float]]) -> np.ndarray:
+    """Scale each vector to unit length so the collection can rank by plain inner product"""
+    vectors = np.asarray(embeddings, dtype=np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True) + 1e-12
+    return vectors
+
+def quantize_embeddings(embeddings: List[List[float]]) -> Tuple[np.ndarray, np.ndarray]:
+    """Symmetric int8 quantization with one float32 scale per row, a quarter of the float32 size"""
+    vectors = np.asarray(embeddings, dtype=np.float32)
+    scales = np.abs(vectors).max(axis=1) / 127
+    # Zero rows (failed batches) keep a unit scale so they dequantize back to zeros
+    scales[scales == 0] = 1.0
+    return np.round(vectors / scales[:, None]).astype(np.int8), scales
+
+def dequantize_embeddings(codes: np.ndarray, scales: np.ndarray) -> List[List[float]]:
+    """Unit-length float vectors back from quantize_embeddings output, ready for the inner-product collection"""
+    return _unit_rows(codes.astype(np.float32) * scales[:, None]).tolist()
+
 # Embeddings Function for Text with Multithreading Support
 class TextEmbeddings(EmbeddingFunction):
     def __init__(self, max_workers: int = None, batch_size: int = None):
         super().__init__()
         self.max_workers = max_workers or RAGConfig.EMBEDDING_MAX_WORKERS or RAGConfig.get_optimal_workers("io")
         self.batch_size = batch_size or RAGConfig.EMBEDDING_BATCH_SIZE
-        self._session = requests.Session() if RAGConfig.USE_SESSION_POOLING else None
+        self._session = _pooled_session(self.max_workers) if RAGConfig.USE_SESSION_POOLING else None
+        self._precomputed = {}
+        self._url = EMBED_URL
+        # Embedding width, learned from the first successful response and used to size fallback rows
+        self._dim = None
+        # A pooled session already carries the API key header
+        self._headers = None if self._session else {'API-KEY': _get_api_key()}
+    
+    def preload(self, texts: List[str], embeddings: List[List[float]]):
+        """Register vectors computed elsewhere; each is handed out once by embed_documents"""
+        self._precomputed.update(zip(texts, embeddings))
     
     def embed(self, string: str):
         """Single embedding generation"""
@@ -25,11 +119,9 @@ class TextEmbeddings(EmbeddingFunction):
         
         for attempt in range(RAGConfig.MAX_RETRIES):
             try:
-                api_key =  str(st.secrets.get('OLLAMA-API-KEY'))
-                
                 response = session.post(
-                    url="https://aihub-vvitu.social/api/ollama-api/embed/",
-                    headers={'API-KEY': api_key},
+                    url=self._url,
+                    headers=self._headers,
                     json={
                         'model': 'qwen3-embedding:8b',
                         'input': string
@@ -37,49 +129,115 @@ class TextEmbeddings(EmbeddingFunction):
                     timeout=RAGConfig.REQUEST_TIMEOUT
                 )
                 response.raise_for_status()
-                return response.json()['embeddings'][0]
+                # Unit-length vectors let the collection rank by plain inner product
+                vector = np.asarray(response.json()['embeddings'][0], dtype=np.float32)
+                vector /= np.linalg.norm(vector) + 1e-12
+                return vector.tolist()
             except Exception as e:
                 if attempt == RAGConfig.MAX_RETRIES - 1:
                     raise e
                 time.sleep(0.5 * (attempt + 1))  # Exponential backoff
     
-    def _embed_batch(self, texts: List[str]) -> List[List[float]]:
-        """Embed a batch of texts concurrently"""
-        embeddings = [None] * len(texts)
-        
-        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
-            # Submit all embedding tasks
-            future_to_index = {
-                executor.submit(self.embed, text): i 
-                for i, text in enumerate(texts)
-            }
-            
-            # Collect results as they complete
-            for future in as_completed(future_to_index):
-                index = future_to_index[future]
+    def embed_many(self, texts: List[str]) -> np.ndarray:
+        """Embed a list of texts with a single request; the endpoint accepts a list as input"""
+        session = self._session or requests
+        response = session.post(
+            url=self._url,
+            headers=self._headers,
+            json={
+                'model': 'qwen3-embedding:8b',
+                'input': texts
+            },
+            timeout=RAGConfig.REQUEST_TIMEOUT
+        )
+        response.raise_for_status()
+        vectors = _unit_rows(response.json()['embeddings'])
+        self._dim = vectors.shape[1]
+        return vectors
+    
+    def _fallback_rows(self, count: int) -> np.ndarray:
+        """Zero vectors for a failed batch, as wide as the model's real output once it is known"""
+        return np.zeros((count, self._dim or 1024), dtype=np.float32)
+    
+    def _embed_batch(self, texts: List[str]) -> np.ndarray:
+        """Embed a batch of texts in one request, retrying with backoff"""
+        for attempt in range(RAGConfig.MAX_RETRIES):
+            try:
+                return self.embed_many(texts)
+            except Exception as exc:
+                if attempt == RAGConfig.MAX_RETRIES - 1:
+                    print(f'Embedding generation failed for a batch of {len(texts)} texts: {exc}')
+                    # Return zero vectors as fallback
+                    return self._fallback_rows(len(texts))
+                time.sleep(0.5 * (attempt + 1))  # Exponential backoff
+    
+    async def _aembed_batch(self, client: httpx.AsyncClient, semaphore: asyncio.Semaphore, texts: List[str]) -> np.ndarray:
+        """Async twin of _embed_batch: one request per batch, at most max_workers in flight"""
+        async with semaphore:
+            for attempt in range(RAGConfig.MAX_RETRIES):
                 try:
-                    embeddings[index] = future.result()
+                    response = await client.post(self._url, json={'model': 'qwen3-embedding:8b', 'input': texts})
+                    response.raise_for_status()
+                    vectors = _unit_rows(response.json()['embeddings'])
+                    self._dim = vectors.shape[1]
+                    return vectors
                 except Exception as exc:
-                    print(f'Embedding generation failed for text {index}: {exc}')
-                    # Return a zero vector as fallback
-                    embeddings[index] = [0.0] * 1024  # Adjust dimension as needed
-        
-        return embeddings
+                    if attempt == RAGConfig.MAX_RETRIES - 1:
+                        print(f'Embedding generation failed for a batch of {len(texts)} texts: {exc}')
+                        return self._fallback_rows(len(texts))
+                    await asyncio.sleep(0.5 * (attempt + 1))  # Exponential backoff
+    
+    async def _aembed_all(self, batches: List[List[str]]) -> List[np.ndarray]:
+        """Embed every batch over the process-wide keep-alive client, at most max_workers at once"""
+        client = await _async_client()
+        semaphore = asyncio.Semaphore(self.max_workers)
+        return await asyncio.gather(*(self._aembed_batch(client, semaphore, batch) for batch in batches))
     
     def embed_documents(self, texts: List[str]) -> List[List[float]]:
         """Embed multiple documents with batch processing and concurrency"""
         if not texts:
             return []
         
-        all_embeddings = []
+        # Serve preloaded vectors first and only call the API for the rest
+        if self._precomputed:
+            vectors = [self._precomputed.get(text) for text in texts]
+            for text in texts:
+                self._precomputed.pop(text, None)
+            missing = [i for i, vector in enumerate(vectors) if vector is None]
+            if missing:
+                for i, vector in zip(missing, self._embed_unique([texts[i] for i in missing])):
+                    vectors[i] = vector
+            return vectors
+        
+        return self._embed_unique(texts)
+    
+    def _embed_unique(self, texts: List[str]) -> List[List[float]]:
+        """Embed each distinct text once and fan the vectors back out to every position it occupies"""
+        # Shared headers, footers and tables repeat across chunks; the text itself is the exact dedup key
+        positions = {}
+        index = [positions.setdefault(text, len(positions)) for text in texts]
+        if len(positions) == len(texts):
+            return self._embed_texts(texts)
+        
+        unique = self._embed_texts(list(positions))
+        return [unique[i] for i in index]
+    
+    def _embed_texts(self, texts: List[str]) -> List[List[float]]:
+        """Embed texts through the API, batched and concurrent"""
+        # One request per batch; only the batches run concurrently
+        batches = [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+        if len(batches) == 1:
+            return self._embed_batch(batches[0]).tolist()
+        
+        # Batches go out concurrently on the shared embedding loop, which also works when the caller runs its own loop
+        results = asyncio.run_coroutine_threadsafe(self._aembed_all(batches), _async_loop()).result()
         
-        # Process in batches to avoid overwhelming the API
-        for i in range(0, len(texts), self.batch_size):
-            batch = texts[i:i + self.batch_size]
-            batch_embeddings = self._embed_batch(batch)
-            all_embeddings.extend(batch_embeddings)
+        # A failed batch may fall back to the default width before any response revealed the real one
+        if self._dim is not None:
+            results = [batch if batch.shape[1] == self._dim else self._fallback_rows(len(batch)) for batch in results]
         
-        return all_embeddings
+        # One contiguous float32 block; the list form is only built for the LangChain/Chroma interface
+        return np.concatenate(results).tolist()
 
     def embed_query(self, text: str) -> List[float]:
         """Embed a single query"""
@@ -88,30 +246,33 @@ class TextEmbeddings(EmbeddingFunction):
 # Describing the Image with optimized processing
 def encode_image_to_base64(image_path):
     """Helper function to encode image to base64"""
-    with open(image_path, "rb") as image_file:
-        encoded_string = base64.b64encode(image_file.read()).decode('utf-8')
-    return encoded_string
+    # Encode straight from the page cache; base64 output is pure ASCII
+    with open(image_path, "rb") as image_file, mmap.mmap(image_file.fileno(), 0, access=mmap.ACCESS_READ) as image_map:
+        return base64.b64encode(image_map).decode('ascii')
 
-def get_image_desc(img):
-    """Get description for a single image"""
-    img_64 = encode_image_to_base64(img)    
-    
-    api_key =  str(st.secrets.get('OLLAMA-API-KEY'))
-    
-    response = requests.post(
-        url="https://aihub-vvitu.social/api/ollama-api/generate/",
-        headers={
-            'API-KEY': api_key
-        },
+# Descriptions depend only on the image bytes, so they persist across sessions and restarts
+@st.cache_data(show_spinner=False, persist="disk")
+def _describe_image(digest: str, _image_path: str) -> str:
+    """Describe an image once per content digest; failed requests raise and are not cached"""
+    response = _image_session().post(
+        url=GENERATE_URL,
         json={
             "model": "moondream:latest",
             "prompt": "Describe the image in detail",
-            "images": [img_64],
+            "images": [encode_image_to_base64(_image_path)],
             "stream":False
         }
     )
     response.raise_for_status()
-    return [Document(metadata={'file_name': img}, page_content=response.json()['response'])]
+    return response.json()['response']
+
+def get_image_desc(img):
+    """Get description for a single image"""
+    # Hash the mapped file rather than a bytes copy; the image is only encoded on a cache miss
+    with open(img, "rb") as image_file, mmap.mmap(image_file.fileno(), 0, access=mmap.ACCESS_READ) as image_map:
+        digest = hashlib.blake2b(image_map, digest_size=16).hexdigest()
+    
+    return [Document(metadata={'file_name': img}, page_content=_describe_image(digest, img))]
 
 def get_images_desc_batch(image_paths: List[str], max_workers: int = None) -> List[Document]:
     """Process multiple images concurrently"""
@@ -120,6 +281,7 @@ def get_images_desc_batch(image_paths: List[str], max_workers: int = None) -> Li
     
     max_workers = max_workers or RAGConfig.IMAGE_MAX_WORKERS or min(8, len(image_paths))
     all_documents = []
+    extend = all_documents.extend
     
     with ThreadPoolExecutor(max_workers=max_workers) as executor:
         # Submit all image processing tasks
@@ -130,11 +292,10 @@ def get_images_desc_batch(image_paths: List[str], max_workers: int = None) -> Li
         
         # Collect results as they complete
         for future in as_completed(future_to_path):
-            img_path = future_to_path[future]
             try:
-                documents = future.result()
-                all_documents.extend(documents)
+                extend(future.result())
             except Exception as exc:
+                img_path = future_to_path[future]
                 print(f'Image processing failed for {img_path}: {exc}')
                 # Create a fallback document
                 all_documents.append(
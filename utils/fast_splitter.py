@@ -0,0 +1,41 @@
+import re
+from bisect import bisect_left, bisect_right
+from functools import lru_cache
+from typing import List
+
+
+@lru_cache(maxsize=8)
+def _word_pattern(chunk_size: int) -> re.Pattern:
+    """Whitespace-delimited words, with any word longer than a chunk cut into chunk-sized pieces"""
+    return re.compile(r'\S{1,%d}' % chunk_size)
+
+
+# Single-pass alternative to RecursiveCharacterTextSplitter: one regex scan, then greedy packing
+def split_text(text: str, chunk_size: int, chunk_overlap: int) -> List[str]:
+    """Pack whole words into chunks of at most chunk_size characters, overlapping by up to chunk_overlap"""
+    starts = []
+    ends = []
+    for match in _word_pattern(chunk_size).finditer(text):
+        starts.append(match.start())
+        ends.append(match.end())
+
+    chunks = []
+    i = 0
+    while i < len(starts):
+        # Last word that still ends inside the window opened by word i
+        j = bisect_right(ends, starts[i] + chunk_size)
+        chunks.append(text[starts[i]:ends[j - 1]])
+        if j == len(starts):
+            break
+
+        # The next chunk opens at the first word within chunk_overlap characters of this chunk's end,
+        # unless that window could not reach past word j and would repeat the overlap alone
+        i = max(i + 1, bisect_left(starts, ends[j - 1] - chunk_overlap))
+        if bisect_right(ends, starts[i] + chunk_size) <= j:
+            i = j
+    return chunks
+
+
+def fast_split(texts: List[str], chunk_size: int, chunk_overlap: int) -> List[List[str]]:
+    """Split each text independently; the result holds one chunk list per input text"""
+    return [split_text(text, chunk_size, chunk_overlap) for text in texts]
@@ -0,0 +1,86 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, List, Optional
+
+import numpy as np
+
+
+# Semantic cache for retrieval results: near-duplicate queries reuse the previous search
+class QueryCache:
+    """Thread-safe LRU + TTL cache keyed by cosine similarity of query embeddings"""
+
+    def __init__(self, max_size: int = 256, ttl_seconds: float = 600, threshold: float = 0.95):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.threshold = threshold
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # matrix row -> (value, timestamp), least recently used first
+        self._matrix = None            # one fixed row per cached query, allocated on the first put
+        self._used = None              # rows currently holding a live entry
+        self._free = []                # rows available for new entries
+        self._lock = threading.RLock()
+
+    @staticmethod
+    def _normalize(embedding: List[float]) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        return vector / (np.linalg.norm(vector) + 1e-12)
+
+    def _release(self, row: int):
+        del self._entries[row]
+        self._used[row] = False
+        self._free.append(row)
+
+    def _evict_expired(self):
+        cutoff = time.time() - self.ttl_seconds
+        for row in [row for row, (_, timestamp) in self._entries.items() if timestamp < cutoff]:
+            self._release(row)
+
+    def get(self, embedding: List[float]) -> Optional[Any]:
+        """Return the value cached for the most similar query above the threshold, or None"""
+        query = self._normalize(embedding)
+        with self._lock:
+            self._evict_expired()
+            if not self._entries or query.shape[0] != self._matrix.shape[1]:
+                self.misses += 1
+                return None
+
+            # One matrix-vector product scores every row at once; free rows can never match
+            scores = np.where(self._used, self._matrix @ query, -np.inf)
+            best = int(np.argmax(scores))
+            if scores[best] < self.threshold:
+                self.misses += 1
+                return None
+
+            # A hit only reorders the LRU bookkeeping; the row stays where it is
+            self._entries.move_to_end(best)
+            self.hits += 1
+            return self._entries[best][0]
+
+    def put(self, embedding: List[float], value: Any):
+        """Store a value for the query embedding, evicting the least recently used entry when full"""
+        vector = self._normalize(embedding)
+        with self._lock:
+            if self._matrix is None or self._matrix.shape[1] != vector.shape[0]:
+                self._reset(vector.shape[0])
+            if not self._free:
+                self._release(next(iter(self._entries)))
+            row = self._free.pop()
+            self._matrix[row] = vector
+            self._used[row] = True
+            self._entries[row] = (value, time.time())
+
+    def _reset(self, dim: Optional[int] = None):
+        self._entries.clear()
+        self._matrix = None if dim is None else np.zeros((self.max_size, dim), dtype=np.float32)
+        self._used = None if dim is None else np.zeros(self.max_size, dtype=bool)
+        self._free = [] if dim is None else list(range(self.max_size - 1, -1, -1))
+
+    def clear(self):
+        """Drop all entries, e.g. after new documents are added to the database"""
+        with self._lock:
+            self._reset()
+
+    def stats(self) -> dict:
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self._entries)}
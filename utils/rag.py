@@ -1,45 +1,56 @@
 from langchain_community.document_loaders import *
 from langchain_text_splitters.character import RecursiveCharacterTextSplitter
 from langchain_community.vectorstores import Chroma
+from langchain_community.docstore.document import Document
 import os
 import shutil
+import hashlib
+import multiprocessing
+from contextlib import nullcontext
 from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
 from typing import List, Dict, Tuple, Optional
 import time
 import streamlit as st
 
-from .embeddings import TextEmbeddings, get_image_desc, get_images_desc_batch
+from .embeddings import TextEmbeddings, get_image_desc, get_images_desc_batch, quantize_embeddings, dequantize_embeddings
 from .config import RAGConfig
+from .fast_splitter import fast_split
+
+# Loader for each supported extension; images are described by the vision model instead
+_LOADERS = {
+    '.pdf': lambda path: PyPDFLoader(file_path=path).load(),
+    '.docx': lambda path: Docx2txtLoader(file_path=path).load(),
+    '.json': lambda path: JSONLoader(file_path=path).load(),
+    '.csv': lambda path: CSVLoader(file_path=path).load(),
+    '.py': lambda path: PythonLoader(file_path=path).load(),
+    '.ipynb': lambda path: NotebookLoader(path=path).load(),
+    '.md': lambda path: TextLoader(file_path=path).load(),
+    '.jpg': get_image_desc,
+    '.jpeg': get_image_desc,
+    '.png': get_image_desc
+}
+
+@st.cache_resource
+def get_process_pool():
+    """Process-wide worker pool for parsing and splitting, created once and shared by every upload"""
+    # Workers are spawned, not forked: a fork of the threaded server could inherit locks held by other threads
+    return ProcessPoolExecutor(max_workers=os.cpu_count() or 1, mp_context=multiprocessing.get_context("spawn"))
 
 # Preparing Documents from the input files with optimized processing
 def process_input_file(input_file_name: str):
     """Process a single input file and return documents"""
     try:
-        if input_file_name.endswith('.pdf'):
-            return PyPDFLoader(file_path=input_file_name).load()
-        elif input_file_name.endswith('.docx'):
-            return Docx2txtLoader(file_path=input_file_name).load()
-        elif input_file_name.endswith('.json'):
-            return JSONLoader(file_path=input_file_name).load()
-        elif input_file_name.endswith('.csv'):
-            return CSVLoader(file_path=input_file_name).load()
-        elif input_file_name.endswith('.py'):
-            return PythonLoader(file_path=input_file_name).load()
-        elif input_file_name.endswith('.ipynb'):
-            return NotebookLoader(path=input_file_name).load()
-        elif input_file_name.endswith('.md'):
-            return TextLoader(file_path=input_file_name).load()
-        elif input_file_name.endswith(('.jpg', '.png', '.jpeg')):
-            return get_image_desc(input_file_name)
-        else:
+        loader = _LOADERS.get(os.path.splitext(input_file_name)[1].lower())
+        if loader is None:
             print(f"Unsupported file type: {input_file_name}")
             return []
+        return loader(input_file_name)
     except Exception as e:
         print(f"Error processing file {input_file_name}: {e}")
         return []
 
-def process_input_files_batch(input_file_names: List[str], max_workers: int = None) -> List:
-    """Process multiple input files concurrently"""
+def process_input_files_batch(input_file_names: List[str], max_workers: int = None, executor_cls=ThreadPoolExecutor) -> List:
+    """Process multiple input files concurrently; pass ProcessPoolExecutor to parse on the shared process pool"""
     if not input_file_names:
         return []
     
@@ -61,94 +72,212 @@ def process_input_files_batch(input_file_names: List[str], max_workers: int = No
     
     # Process other files concurrently
     if other_files:
-        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        extend = all_documents.extend
+        # The shared process pool outlives this call, so only a thread pool is created and shut down here
+        if executor_cls is ProcessPoolExecutor:
+            executor_context = nullcontext(get_process_pool())
+        else:
+            executor_context = executor_cls(max_workers=max_workers)
+        with executor_context as executor:
             future_to_file = {
                 executor.submit(process_input_file, file_path): file_path 
                 for file_path in other_files
             }
             
             for future in as_completed(future_to_file):
-                file_path = future_to_file[future]
                 try:
-                    documents = future.result()
-                    if documents:
-                        all_documents.extend(documents)
+                    extend(future.result() or ())
                 except Exception as exc:
-                    print(f'File processing failed for {file_path}: {exc}')
+                    print(f'File processing failed for {future_to_file[future]}: {exc}')
     
     return all_documents
     
-# Obtaining splits from the documents with optimized processing
-def get_splits(docs, chunk_size: int = 500, chunk_overlap: int = 100, max_workers: int = None):
-    """Split documents with optional parallel processing for large document sets"""
-    if not docs:
-        return []
+# Below this many documents, shipping them to worker processes costs more than the split itself
+SPLIT_PROCESS_THRESHOLD = 200
+
+def _split_batch(batch, chunk_size: int, chunk_overlap: int, fast: bool = False):
+    """Split one batch of documents; module-level so worker processes can unpickle it"""
+    if fast:
+        chunk_lists = fast_split([doc.page_content for doc in batch], chunk_size, chunk_overlap)
+        return [
+            Document(page_content=chunk, metadata=dict(doc.metadata))
+            for doc, chunks in zip(batch, chunk_lists)
+            for chunk in chunks
+        ]
     
     splitter = RecursiveCharacterTextSplitter(
         chunk_size=chunk_size,
         chunk_overlap=chunk_overlap
     )
+    return splitter.split_documents(documents=batch)
+
+# Obtaining splits from the documents with optimized processing
+def get_splits(docs, chunk_size: int = 500, chunk_overlap: int = 100, max_workers: int = None):
+    """Split documents, using worker processes for large document sets"""
+    if not docs:
+        return []
     
-    # For small document sets, process sequentially
-    if len(docs) <= 10:
-        return splitter.split_documents(documents=docs)
+    # Splitting is pure Python, so threads would only contend for the GIL; small sets stay in-process
+    if len(docs) <= SPLIT_PROCESS_THRESHOLD:
+        return _split_batch(docs, chunk_size, chunk_overlap, RAGConfig.FAST_SPLITTER)
     
-    # For large document sets, process in parallel batches
-    max_workers = max_workers or min(4, len(docs) // 5)
+    # For large document sets, split batches on the shared process pool, at most one batch per core
+    max_workers = min(max_workers or 4, os.cpu_count() or 1)
     batch_size = max(1, len(docs) // max_workers)
     
     all_splits = []
+    executor = get_process_pool()
     
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        # Create batches of documents
-        batches = [docs[i:i + batch_size] for i in range(0, len(docs), batch_size)]
-        
-        # Submit splitting tasks
-        future_to_batch = {
-            executor.submit(splitter.split_documents, batch): i 
-            for i, batch in enumerate(batches)
-        }
-        
-        # Collect results
-        batch_results = [None] * len(batches)
-        for future in as_completed(future_to_batch):
-            batch_idx = future_to_batch[future]
-            try:
-                batch_results[batch_idx] = future.result()
-            except Exception as exc:
-                print(f'Document splitting failed for batch {batch_idx}: {exc}')
-                batch_results[batch_idx] = []
-        
-        # Flatten results while maintaining order
-        for batch_result in batch_results:
-            if batch_result:
-                all_splits.extend(batch_result)
+    # Create batches of documents
+    batches = [docs[i:i + batch_size] for i in range(0, len(docs), batch_size)]
+    
+    # Submit splitting tasks
+    future_to_batch = {
+        executor.submit(_split_batch, batch, chunk_size, chunk_overlap, RAGConfig.FAST_SPLITTER): i 
+        for i, batch in enumerate(batches)
+    }
+    
+    # Collect results
+    batch_results = [None] * len(batches)
+    for future in as_completed(future_to_batch):
+        batch_idx = future_to_batch[future]
+        try:
+            batch_results[batch_idx] = future.result()
+        except Exception as exc:
+            print(f'Document splitting failed for batch {batch_idx}: {exc}')
+            batch_results[batch_idx] = []
+    
+    # Flatten results while maintaining order
+    for batch_result in batch_results:
+        if batch_result:
+            all_splits.extend(batch_result)
     
     return all_splits
 
+# Embeddings are deterministic for a fixed model, so re-processing identical content skips the API entirely
+@st.cache_data(show_spinner=False, ttl=24 * 60 * 60)
+def cached_chunk_embeddings(texts: Tuple[str, ...], quantize: bool, _embedding_fn):
+    """One file's chunk vectors, keyed on the chunk contents; quantized entries hold (int8 codes, scales)"""
+    embeddings = _embedding_fn.embed_documents(list(texts))
+    # Failed batches come back as zero rows; raising keeps them out of the cache
+    if not all(any(vector) for vector in embeddings):
+        raise ValueError(f"embedding failed for some of {len(texts)} chunks")
+    return quantize_embeddings(embeddings) if quantize else embeddings
+
+def preload_embeddings(splits, embedding_fn):
+    """Fill embedding_fn with per-file vectors, served from the cache or embedded one file at a time"""
+    texts_by_file = {}
+    for split in splits:
+        source = split.metadata.get('source') or split.metadata.get('file_name')
+        texts_by_file.setdefault(source, []).append(split.page_content)
+    
+    quantize = RAGConfig.EMBEDDING_QUANTIZE
+    loaded = []
+    for texts in texts_by_file.values():
+        key = tuple(texts)
+        try:
+            embeddings = cached_chunk_embeddings(key, quantize, embedding_fn)
+        except Exception as e:
+            # Nothing is preloaded, so Chroma's own embed_documents call retries this file
+            print(f"Could not embed {len(key)} chunks ahead of indexing: {e}")
+            continue
+        loaded.append((key, dequantize_embeddings(*embeddings) if quantize else embeddings))
+    
+    # Preload only once every file is embedded, so a chunk shared between files is not handed out early
+    for key, embeddings in loaded:
+        embedding_fn.preload(key, embeddings)
+
+# One persisted collection per login session; data/<session_id> only holds the uploads and is removed after each run
+CHROMA_DIR = 'data/chroma'
+STORE_MAX_AGE = 7 * 24 * 60 * 60  # Matches the 7-day session expiry
+
+def remove_store(session_id: str):
+    """Delete a session's persisted collection, e.g. on logout"""
+    shutil.rmtree(os.path.join(CHROMA_DIR, session_id), ignore_errors=True)
+
+def prune_stores(max_age: int = STORE_MAX_AGE):
+    """Delete collections of sessions that expired without logging out"""
+    if not os.path.isdir(CHROMA_DIR):
+        return
+    cutoff = time.time() - max_age
+    for entry in os.scandir(CHROMA_DIR):
+        try:
+            if entry.is_dir() and entry.stat().st_mtime < cutoff:
+                shutil.rmtree(entry.path, ignore_errors=True)
+        except OSError as e:
+            print(f"Warning: Could not prune {entry.path}: {e}")
+
+def open_db(persist_dir: str, embedding_fn):
+    """Open (or create) the persisted collection in persist_dir"""
+    # Embeddings are L2-normalized, so inner product ranks exactly like cosine without the per-query norms
+    return Chroma(
+        persist_directory=persist_dir,
+        embedding_function=embedding_fn,
+        collection_metadata={"hnsw:space": "ip"}
+    )
+
+def add_new_splits(db, splits) -> int:
+    """Add only the splits the collection does not hold yet; ids are digests of file name and content"""
+    ids_to_split = {}
+    for split in splits:
+        # Sources are per-run temp paths, so only the file name is stable across runs
+        source = os.path.basename(split.metadata.get('source') or split.metadata.get('file_name') or '')
+        key = hashlib.blake2b(f"{source}\0{split.page_content}".encode(), digest_size=16).hexdigest()
+        ids_to_split.setdefault(key, split)
+    
+    existing = set(db.get(ids=list(ids_to_split), include=[])['ids'])
+    new_ids = [key for key in ids_to_split if key not in existing]
+    if new_ids:
+        new_splits = [ids_to_split[key] for key in new_ids]
+        # Only vectors for chunks that are actually inserted are preloaded
+        if isinstance(db.embeddings, TextEmbeddings):
+            preload_embeddings(new_splits, db.embeddings)
+        db.add_documents(documents=new_splits, ids=new_ids)
+    return len(new_ids)
+
 # Creating a ChromaDB to store the data for efficient retrieval with optimized embeddings
-def get_db(splits, embedding_max_workers: int = None, embedding_batch_size: int = 10):
-    """Create ChromaDB with optimized embedding generation"""
+def get_db(splits, embedding_max_workers: int = None, embedding_batch_size: int = 10, embedding_fn=None, persist_dir: str = None):
+    """Create ChromaDB with optimized embedding generation; with persist_dir the collection on disk is reused and extended"""
     if not splits:
         return None
     
     # Use optimized embedding function with concurrent processing
-    embedding_fn = TextEmbeddings(
+    embedding_fn = embedding_fn or TextEmbeddings(
         max_workers=embedding_max_workers, 
         batch_size=embedding_batch_size
     )
     
     try:
-        db = Chroma.from_documents(documents=splits, embedding=embedding_fn)
+        if persist_dir is not None:
+            db = open_db(persist_dir, embedding_fn)
+            add_new_splits(db, splits)
+            return db
+        
+        # Embeddings are L2-normalized, so inner product ranks exactly like cosine without the per-query norms
+        db = Chroma.from_documents(documents=splits, embedding=embedding_fn, collection_metadata={"hnsw:space": "ip"})
         return db
     except Exception as e:
         print(f"Error creating database: {e}")
         return None
 
+def save_upload(uploaded_file, temp_path: str) -> str:
+    """Write one upload to disk without materializing a second copy of its bytes"""
+    os.makedirs(os.path.dirname(temp_path), exist_ok=True)
+    with open(temp_path, "wb") as f:
+        if hasattr(uploaded_file, 'getbuffer'):
+            # In-memory uploads are written straight from their buffer
+            f.write(uploaded_file.getbuffer())
+        else:
+            # Other file objects are streamed in 1 MB chunks
+            uploaded_file.seek(0)
+            shutil.copyfileobj(uploaded_file, f, 1 << 20)
+    return temp_path
+
 # RAG - Documents -> Splits -> DB with optimized concurrent processing
 def process_docs(session_id, uploaded_files, processed_files: list, existing_db=None, 
                 max_workers: int = None, embedding_batch_size: int = None, 
-                chunk_size: int = None, chunk_overlap: int = None):
+                chunk_size: int = None, chunk_overlap: int = None, on_progress=None,
+                executor_cls=ThreadPoolExecutor):
     """
     Process documents with optimized concurrent processing
     
@@ -161,6 +290,8 @@ def process_docs(session_id, uploaded_files, processed_files: list, existing_db=
         embedding_batch_size: Batch size for embedding generation
         chunk_size: Text chunk size for splitting
         chunk_overlap: Overlap between text chunks
+        on_progress: Callback receiving (percent, message) as each stage completes (optional)
+        executor_cls: Executor used to parse non-image files (ThreadPoolExecutor or ProcessPoolExecutor)
     """
     # Initialize configuration values with defaults
     max_workers = max_workers or RAGConfig.DOC_PROCESSING_MAX_WORKERS or RAGConfig.get_optimal_workers("mixed")
@@ -173,6 +304,7 @@ def process_docs(session_id, uploaded_files, processed_files: list, existing_db=
         print(f"Configuration: workers={max_workers}, batch_size={embedding_batch_size}, chunk_size={chunk_size}")
     
     start_time = time.time()
+    report = on_progress or (lambda percent, message: None)
     
     all_docs = []
     new_processed = []
@@ -182,28 +314,30 @@ def process_docs(session_id, uploaded_files, processed_files: list, existing_db=
     os.makedirs(f'data/{session_id}', exist_ok=True)
     
     try:
-        # Save files to temp directory first
-        for uploaded_file in uploaded_files:
-            if uploaded_file.name not in processed_files:
-                temp_path = f"data/{session_id}/{uploaded_file.name}"
-                with open(temp_path, "wb") as f:
-                    f.write(uploaded_file.getvalue())
-                temp_files.append(temp_path)
-                new_processed.append(uploaded_file.name)
+        # Save files to temp directory first; writes to distinct files overlap in a small thread pool
+        new_uploads = [uploaded_file for uploaded_file in uploaded_files if uploaded_file.name not in processed_files]
+        if new_uploads:
+            # One subdirectory per upload: same-named files never share a path, and the file name itself is kept
+            temp_paths = [f"data/{session_id}/{i}/{uploaded_file.name}" for i, uploaded_file in enumerate(new_uploads)]
+            with ThreadPoolExecutor(max_workers=min(8, len(new_uploads))) as executor:
+                temp_files = list(executor.map(save_upload, new_uploads, temp_paths))
+            new_processed = [uploaded_file.name for uploaded_file in new_uploads]
         
         if not temp_files:
             print("No new files to process.")
             return existing_db, processed_files
         
         print(f"Loading {len(temp_files)} files...")
+        report(10, "Loading and processing files...")
         # Process files concurrently
-        all_docs = process_input_files_batch(temp_files, max_workers=max_workers)
+        all_docs = process_input_files_batch(temp_files, max_workers=max_workers, executor_cls=executor_cls)
         
         if not all_docs:
             print("No documents extracted from files.")
             return existing_db, processed_files
         
         print(f"Extracted {len(all_docs)} documents. Creating text splits...")
+        report(40, "Creating text splits...")
         # Create splits with optimized processing
         splits = get_splits(all_docs, chunk_size=chunk_size, chunk_overlap=chunk_overlap, max_workers=max_workers)
         
@@ -212,23 +346,28 @@ def process_docs(session_id, uploaded_files, processed_files: list, existing_db=
             return existing_db, processed_files
         
         print(f"Created {len(splits)} text splits. Generating embeddings...")
+        report(60, "Generating embeddings...")
         
-        # Create or update database
-        if existing_db is None:
+        # Every run goes through the session's persisted collection, so chunks already stored are never re-embedded
+        persist_dir = f"{CHROMA_DIR}/{session_id}"
+        prune_stores()
+        try:
+            # The database's own embedding function is the one Chroma calls on updates
+            db = existing_db
+            if db is None or not isinstance(db.embeddings, TextEmbeddings):
+                db = open_db(persist_dir, TextEmbeddings(max_workers=max_workers, batch_size=embedding_batch_size))
+            added = add_new_splits(db, splits)
+            # The directory's mtime marks the session as active for prune_stores
+            os.utime(persist_dir)
+            print(f"Added {added} new chunks ({len(splits) - added} already stored)")
+        except Exception as e:
+            print(f"Error updating persisted database: {e}")
+            # Fallback: create new in-memory database
             db = get_db(splits, embedding_max_workers=max_workers, embedding_batch_size=embedding_batch_size)
-        else:
-            # Use optimized embedding function for updates too
-            embedding_fn = TextEmbeddings(max_workers=max_workers, batch_size=embedding_batch_size)
-            try:
-                existing_db.add_documents(documents=splits, embeddings=embedding_fn)
-                db = existing_db
-            except Exception as e:
-                print(f"Error updating existing database: {e}")
-                # Fallback: create new database
-                db = get_db(splits, embedding_max_workers=max_workers, embedding_batch_size=embedding_batch_size)
         
         # Update processed files list
         processed_files.extend(new_processed)
+        report(100, "Finalizing database...")
         
         processing_time = time.time() - start_time
         print(f"Processing completed in {processing_time:.2f} seconds")
@@ -2,7 +2,7 @@ import streamlit as st
 from uuid import uuid1
 
 def initialize_session_state():
-    if 'session-state' not in st.session_state:
+    if 'session-id' not in st.session_state:
         st.session_state['session-id'] = str(uuid1())
         
     if 'docs' not in st.session_state:
@@ -12,4 +12,11 @@ def initialize_session_state():
         st.session_state['processed'] = []
         
     if 'db' not in st.session_state:
-        st.session_state['db'] = None
\ No newline at end of file
+        st.session_state['db'] = None
+
+def release_vector_store():
+    """Delete the session's persisted collection; called on logout before the state is cleared"""
+    if st.session_state.get('db') is not None:
+        # utils.rag is already loaded whenever a database exists
+        from utils.rag import remove_store
+        remove_store(st.session_state['session-id'])